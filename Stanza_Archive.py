@@ -0,0 +1,304 @@
+# StanzaCam - Photo archive and catalog
+#
+# Photos are stored by content (objects/ab/ab12...ef.jpg, named after their SHA-256)
+# and every shot gets a row in a SQLite catalog (catalog.db) with its prompt, model,
+# poem, stage timings and print status. All disk work - JPEG encoding included -
+# happens on one background writer thread, so taking a shot never waits on the SD card.
+#
+# Export after an event:
+#   python3 Stanza_Archive.py export captures out/ --status printed
+#   python3 Stanza_Archive.py stats captures
+
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import queue
+import shutil
+import sqlite3
+import threading
+import time
+import zipfile
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shots (
+    id TEXT PRIMARY KEY,
+    taken REAL NOT NULL,         -- Unix time the photo was taken
+    photo TEXT,                  -- SHA-256 of the JPEG in objects/
+    width INTEGER,
+    height INTEGER,
+    style INTEGER,               -- Rotary 1 position
+    model_position INTEGER,      -- Rotary 2 position
+    prompt TEXT,
+    model TEXT,
+    poem TEXT,
+    error TEXT,
+    print_status TEXT,           -- captured, printed, spooled, failed, not printed, printer offline
+    total_ms REAL,
+    timings TEXT                 -- JSON {stage: ms} from the shot's trace
+);
+CREATE INDEX IF NOT EXISTS shots_taken ON shots(taken);
+CREATE INDEX IF NOT EXISTS shots_status ON shots(print_status);
+CREATE INDEX IF NOT EXISTS shots_model ON shots(model);
+"""
+
+UPDATE_FIELDS = ("prompt", "model", "poem", "error", "print_status", "total_ms", "timings")
+
+
+def photo_path(directory, digest):
+    return os.path.join(directory, "objects", digest[:2], digest + ".jpg")
+
+
+def connect(directory):
+    """Open (and create if needed) the catalog in an archive directory"""
+    os.makedirs(directory, exist_ok=True)
+    db = sqlite3.connect(os.path.join(directory, "catalog.db"))
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA journal_mode=WAL")    # Readers (e.g. an export) don't block the writer
+    db.execute("PRAGMA synchronous=NORMAL")  # Still safe with WAL, far fewer syncs on the SD card
+    db.executescript(SCHEMA)
+    return db
+
+
+class Archive:
+    """Content-addressed photo store and SQLite catalog, written from a background thread
+
+    add() and update() only queue the work and never block. Each queued shot holds
+    its photo in memory, so if the writer falls max_pending shots behind (e.g. a slow
+    or dying SD card) new shots are left out of the archive rather than holding up
+    the camera.
+    """
+
+    def __init__(self, directory, max_pending=16, jpeg_quality=90):
+        self.directory = directory
+        self.jpeg_quality = jpeg_quality
+        self.max_pending = max_pending
+        self.jobs = queue.Queue()
+        self.pending = 0  # Photos queued but not yet written
+        self.dropped = 0
+        self.lock = threading.Lock()
+        connect(directory).close()  # Create the catalog now, so a bad path fails at startup
+        self.thread = threading.Thread(target=self._writer, daemon=True)
+        self.thread.start()
+
+    def add(self, capture, style=None, model_position=None, prompt=None, model=None):
+        """Archive a new shot, returns its id (also kept on the capture as archive_id), None if dropped"""
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.dropped += 1
+                print(f"ERROR: Archive writer is behind, shot not archived ({self.dropped} so far)")
+                return None
+            self.pending += 1
+        shot_id = f"{capture.timestamp:.3f}".replace(".", "_")
+        capture.archive_id = shot_id
+        row = {"id": shot_id, "taken": capture.timestamp, "width": capture.image.width,
+               "height": capture.image.height, "style": style, "model_position": model_position,
+               "prompt": prompt, "model": model, "print_status": "captured"}
+        self.jobs.put(("add", row, capture))
+        return shot_id
+
+    def update(self, shot_id, **fields):
+        """Fill in details as the shot progresses, e.g. update(id, poem=..., print_status="printed")"""
+        unknown = set(fields) - set(UPDATE_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown archive fields: {', '.join(sorted(unknown))}")
+        if isinstance(fields.get("timings"), dict):
+            fields["timings"] = json.dumps(fields["timings"])
+        self.jobs.put(("update", shot_id, fields))
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far is on disk, returns False on timeout"""
+        done = threading.Event()
+        self.jobs.put(("flush", done, None))
+        return done.wait(timeout)
+
+    def _store_photo(self, capture):
+        data = capture.jpeg(self.jpeg_quality)
+        digest = hashlib.sha256(data).hexdigest()
+        path = photo_path(self.directory, digest)
+        if not os.path.exists(path):  # Same content, same file - nothing to write
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return digest
+
+    def _writer(self):
+        db = connect(self.directory)
+        while True:
+            # Everything waiting goes into one transaction - one sync instead of one per row
+            batch = [self.jobs.get()]
+            while True:
+                try:
+                    batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+
+            # Photos first, each on its own, so a failed write only loses that shot
+            writes, flushes = [], []
+            for kind, first, second in batch:
+                if kind == "add":
+                    try:
+                        writes.append(("add", dict(first, photo=self._store_photo(second))))
+                    except OSError as e:
+                        print(f"ERROR: Archive photo write failed, shot {first['id']} not archived - {e}")
+                    finally:
+                        with self.lock:
+                            self.pending -= 1
+                elif kind == "update":
+                    writes.append(("update", (first, second)))
+                else:
+                    flushes.append(first)
+
+            try:
+                with db:
+                    for kind, values in writes:
+                        if kind == "add":
+                            columns = ", ".join(values)
+                            db.execute(f"INSERT OR REPLACE INTO shots ({columns}) VALUES "
+                                       f"({', '.join('?' * len(values))})", list(values.values()))
+                        else:
+                            shot_id, fields = values
+                            assignments = ", ".join(f"{name} = ?" for name in fields)
+                            db.execute(f"UPDATE shots SET {assignments} WHERE id = ?", [*fields.values(), shot_id])
+            except sqlite3.Error as e:
+                print(f"ERROR: Archive write failed - {e}")
+            finally:
+                for _ in batch:
+                    self.jobs.task_done()
+                for done in flushes:
+                    done.set()
+
+
+def query_shots(db, since=None, until=None, status=None, model=None):
+    """Catalog rows matching the filters, oldest first"""
+    conditions, params = [], []
+    if since is not None:
+        conditions.append("taken >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("taken < ?")
+        params.append(until)
+    if status:
+        conditions.append("print_status = ?")
+        params.append(status)
+    if model:
+        conditions.append("model = ?")
+        params.append(model)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    return db.execute(f"SELECT * FROM shots{where} ORDER BY taken", params).fetchall()
+
+
+def export_name(row):
+    return f"capture_{time.strftime('%Y-%m-%d_%H-%M-%S', time.localtime(row['taken']))}_{row['id'][-3:]}.jpg"
+
+
+def export(directory, destination, rows, as_zip=False):
+    """Copy the photos and a CSV of the catalog rows to destination (a folder, or a .zip file)"""
+    columns = [name for name in rows[0].keys() if name != "photo"] + ["file"] if rows else []
+    exported = 0
+
+    if as_zip:
+        os.makedirs(os.path.dirname(os.path.abspath(destination)), exist_ok=True)
+        # JPEGs don't compress any further, so just store them
+        with zipfile.ZipFile(destination, "w", zipfile.ZIP_STORED) as archive_zip:
+            lines = []
+            for row in rows:
+                record = _export_record(row)
+                if row["photo"] and os.path.exists(photo_path(directory, row["photo"])):
+                    archive_zip.write(photo_path(directory, row["photo"]), record["file"])
+                    exported += 1
+                lines.append(record)
+            archive_zip.writestr("shots.csv", _csv_text(columns, lines))
+        return exported
+
+    os.makedirs(destination, exist_ok=True)
+    lines = []
+    for row in rows:
+        record = _export_record(row)
+        source = photo_path(directory, row["photo"]) if row["photo"] else None
+        if source and os.path.exists(source):
+            target = os.path.join(destination, record["file"])
+            if not os.path.exists(target):
+                try:
+                    os.link(source, target)  # Same filesystem - no copying at all
+                except OSError:
+                    shutil.copyfile(source, target)
+            exported += 1
+        lines.append(record)
+    with open(os.path.join(destination, "shots.csv"), "w", newline="") as f:
+        f.write(_csv_text(columns, lines))
+    return exported
+
+
+def _export_record(row):
+    record = {name: row[name] for name in row.keys() if name != "photo"}
+    record["file"] = export_name(row) if row["photo"] else ""
+    return record
+
+
+def _csv_text(columns, records):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns)
+    writer.writeheader()
+    writer.writerows(records)
+    return buffer.getvalue()
+
+
+def parse_time(text):
+    """Unix time from YYYY-MM-DD or YYYY-MM-DD HH:MM (local time)"""
+    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(time.strptime(text, fmt))
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"Expected YYYY-MM-DD or 'YYYY-MM-DD HH:MM', got {text!r}")
+
+
+def export_command(args):
+    db = connect(args.archive)
+    rows = query_shots(db, args.since, args.until, args.status, args.model)
+    if not rows:
+        print("No shots match")
+        return
+    start = time.time()
+    count = export(args.archive, args.destination, rows, as_zip=args.destination.endswith(".zip"))
+    print(f"Exported {count} photos ({len(rows)} shots) to {args.destination} in {time.time() - start:.1f} s")
+
+
+def stats_command(args):
+    db = connect(args.archive)
+    total, first, last = db.execute("SELECT COUNT(*), MIN(taken), MAX(taken) FROM shots").fetchone()
+    if not total:
+        print("Archive is empty")
+        return
+    print(f"{total} shots, {time.strftime('%Y-%m-%d %H:%M', time.localtime(first))} to "
+          f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(last))}")
+    for column in ("print_status", "model"):
+        print(f"\nBy {column.replace('_', ' ')}:")
+        for value, count in db.execute(f"SELECT {column}, COUNT(*) FROM shots GROUP BY {column} ORDER BY 2 DESC"):
+            print(f"  {count:>6}  {value}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="StanzaCam archive tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Copy photos and a CSV of their details")
+    export_parser.add_argument("archive", help="Archive folder (ARCHIVE_DIR)")
+    export_parser.add_argument("destination", help="Folder to export to, or a .zip file")
+    export_parser.add_argument("--since", type=parse_time, help="From YYYY-MM-DD [HH:MM]")
+    export_parser.add_argument("--until", type=parse_time, help="Before YYYY-MM-DD [HH:MM]")
+    export_parser.add_argument("--status", help="Only this print status, e.g. printed")
+    export_parser.add_argument("--model", help="Only this model")
+    export_parser.set_defaults(func=export_command)
+
+    stats_parser = commands.add_parser("stats", help="Shot counts by print status and model")
+    stats_parser.add_argument("archive", help="Archive folder (ARCHIVE_DIR)")
+    stats_parser.set_defaults(func=stats_command)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,348 @@
+# StanzaCam - Benchmarks
+#
+# Runs on any machine with Pillow and numpy, no camera or printer needed:
+#   python3 Stanza_Bench.py raster photo.jpg
+#   python3 Stanza_Bench.py roi photo.jpg
+#   python3 Stanza_Bench.py resize photo.jpg
+#   python3 Stanza_Bench.py pipeline photo.jpg --save baseline.json
+# The roi benchmark can also run on the camera itself with --camera. The pipeline
+# benchmark runs Stanza_Main end to end on the fakes in Stanza_Fakes.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from PIL import Image
+import Stanza_Raster
+from Stanza_Image import PRINT_RESIZE_MODES, resize_for_print
+from Stanza_Camera import Capture, camera_roi, process_memory_mb
+
+SERIAL_BAUD = 9600
+
+
+def serial_seconds(num_bytes, baud=SERIAL_BAUD):
+    """Time to send num_bytes over 8N1 serial (10 bits per byte)"""
+    return num_bytes * 10 / baud
+
+
+def time_call(func, repeat):
+    """Best-of-repeat wall time in ms, plus the last result"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def load_print_image(path, width=Stanza_Raster.PRINTER_DOTS):
+    img = Image.open(path).convert("RGB")
+    height = int(width * img.height / img.width)
+    return img.resize((width, height), Image.LANCZOS)
+
+
+def bench_raster(args):
+    """Compare the raster engine's dither modes against escpos' bitImageColumn path"""
+    from escpos.printer import Dummy
+
+    img = load_print_image(args.image)
+    print(f"Print image: {img.width}x{img.height}, best of {args.repeat}")
+    print(f"{'method':<28}{'encode ms':>12}{'bytes':>10}{'serial s':>10}")
+
+    def escpos_column():
+        dummy = Dummy()
+        dummy.profile.profile_data['media']['width']['pixels'] = Stanza_Raster.PRINTER_DOTS
+        dummy.image(img, center=True, impl="bitImageColumn")
+        return dummy.output
+
+    ms, output = time_call(escpos_column, args.repeat)
+    print(f"{'escpos column':<28}{ms:>12.1f}{len(output):>10}{serial_seconds(len(output)):>10.1f}")
+
+    for method in Stanza_Raster.DITHER_METHODS:
+        for compact, label in ((False, method), (True, method + " compact")):
+            ms, bands = time_call(lambda: Stanza_Raster.encode_image(
+                img, method, args.band_bytes, compact=compact, trim_left=args.trim_left), args.repeat)
+            size = sum(len(band) for band in bands)
+            print(f"{label:<28}{ms:>12.1f}{size:>10}{serial_seconds(size):>10.1f}")
+
+
+def bench_resize(args):
+    """Print path downscale modes - time, and how far each lands from the best quality result"""
+    with open(args.image, "rb") as f:
+        jpeg_bytes = f.read()
+    frame = Image.open(io.BytesIO(jpeg_bytes)).convert("RGB")
+    if args.frame_width and frame.width > args.frame_width:
+        # Same size as the camera's main stream, rather than whatever the photo happens to be
+        frame = frame.resize((args.frame_width, round(args.frame_width * frame.height / frame.width)), Image.BICUBIC)
+    print(f"Frame {frame.width}x{frame.height} -> {Stanza_Raster.PRINTER_DOTS} wide, best of {args.repeat}")
+    print(f"{'source':<10}{'mode':<12}{'ms':>10}{'mean diff':>12}")
+
+    reference = resize_for_print(frame, Stanza_Raster.PRINTER_DOTS, "best")
+    reference_gray = np.asarray(reference, dtype=np.float32)
+
+    def from_jpeg(mode):
+        # The photo file itself, not yet decoded (like a spooled shot) - gets the draft mode shortcut
+        return resize_for_print(Image.open(io.BytesIO(jpeg_bytes)), Stanza_Raster.PRINTER_DOTS, mode)
+
+    def rgb_old():
+        # What print_photo used to do - Lanczos on the RGB frame
+        height = round(Stanza_Raster.PRINTER_DOTS * frame.height / frame.width)
+        return frame.resize((Stanza_Raster.PRINTER_DOTS, height), Image.LANCZOS).convert("L")
+
+    cases = [("frame", "old rgb", rgb_old)]
+    cases += [("frame", mode, lambda mode=mode: resize_for_print(frame, Stanza_Raster.PRINTER_DOTS, mode))
+              for mode in PRINT_RESIZE_MODES]
+    cases += [("jpeg", mode, lambda mode=mode: from_jpeg(mode)) for mode in PRINT_RESIZE_MODES]
+    for source, label, func in cases:
+        ms, img = time_call(func, args.repeat)
+        if img.size != reference.size:
+            img = img.resize(reference.size, Image.BILINEAR)
+        # Mean grey level difference from "best" (0-255)
+        diff = np.abs(np.asarray(img, dtype=np.float32) - reference_gray).mean()
+        print(f"{source:<10}{label:<12}{ms:>10.1f}{diff:>12.2f}")
+
+
+def bench_pipeline(args):
+    """Whole shots - capture, poem, print - through Stanza_Main on fake hardware and a mock API"""
+    output = sys.stdout if args.verbose else io.StringIO()
+    with contextlib.redirect_stdout(output):
+        import Stanza_Main  # Complains about a missing config.py, which the settings below make up for
+    from Stanza_Fakes import FakeCamera, FakeGPIO, FakePrinterPort, MockClaudeServer
+    from Stanza_Trace import Trace, load_records, summarize
+
+    server = MockClaudeServer(latency=args.latency, token_interval=args.token_interval).start()
+    gpio = FakeGPIO()
+    camera = FakeCamera(args.images)
+    port = FakePrinterPort(baudrate=args.baud, gpio=gpio, busy_pin=Stanza_Main.DTR)
+    trace_file = tempfile.NamedTemporaryFile(suffix=".jsonl", delete=False)
+    trace_file.close()
+
+    # Settings a config.py would normally give
+    Stanza_Main.ANTHROPIC_API_KEY = "mock"
+    Stanza_Main.PRINTER_BAUD_RATE = args.baud
+    Stanza_Main.PRINT_QUEUE_FULL = "wait"
+    Stanza_Main.STREAM_POEM = not args.no_stream
+    Stanza_Main.SPOOL_ENABLED = False
+    Stanza_Main.ARCHIVE_CAPTURES = False
+    Stanza_Main.ARCHIVE_MODEL_POSITIONS = ()
+    Stanza_Main.REPRINT_CACHE_DIR = None
+    Stanza_Main.TRACE_FILE = trace_file.name
+
+    print(f"{args.shots} shots, API latency {args.latency * 1000:.0f} ms + {args.token_interval * 1000:.0f} ms/token, "
+          f"printer at {args.baud} baud")
+    try:
+        with contextlib.redirect_stdout(output):
+            start = time.time()
+            Stanza_Main.setup(gpio=gpio, camera=camera, printer_port=port, api_base_url=server.base_url)
+            startup = time.time() - start
+            Stanza_Main.focus.wait_focused(5.0)
+
+            # Same calls the main loop makes for a press then a confirm, without the LED pauses
+            start = time.time()
+            for _ in range(args.shots):
+                capture = Stanza_Main.take_image(Trace(style=1))
+                Stanza_Main.queue_print(capture, 1, 1)
+                time.sleep(args.interval)
+            Stanza_Main.print_queue.join()
+            elapsed = time.time() - start
+            Stanza_Main.shutdown()
+        records = load_records([trace_file.name])
+    finally:
+        os.remove(trace_file.name)
+        camera.stop()
+        port.close()
+        server.stop()
+
+    summary = summarize(records)
+    result = {
+        "shots": len(records),
+        "shots_per_minute": len(records) / elapsed * 60,
+        "latency_p50": summary["total"]["p50"],
+        "latency_p95": summary["total"]["p95"],
+        "stages": {name: stats["p50"] for name, stats in summary.items()},
+        "serial_bytes": len(port.received),
+        "overflow_bytes": port.overflow_bytes,
+    }
+
+    print(f"Startup {startup:.1f} s, {result['shots_per_minute']:.1f} shots/min, shot latency p50 "
+          f"{result['latency_p50'] / 1000:.1f} s p95 {result['latency_p95'] / 1000:.1f} s")
+    print(f"Printer got {result['serial_bytes']} bytes, peak buffer {port.max_buffer_level:.0f}/{port.buffer_size}, "
+          f"{port.overflow_bytes} bytes lost to overflow")
+    print(f"\n{'stage (ms)':<16}{'p50':>10}{'p95':>10}{'max':>10}")
+    for name, stats in summary.items():
+        print(f"{name:<16}{stats['p50']:>10.0f}{stats['p95']:>10.0f}{stats['max']:>10.0f}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nSaved to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare_pipeline(result, baseline, args.tolerance):
+            sys.exit(1)
+
+
+def compare_pipeline(result, baseline, tolerance):
+    """Print changes against a saved run, returns False if anything got worse by more than tolerance percent"""
+    print(f"\nAgainst baseline (tolerance {tolerance:.0f}%):")
+    ok = True
+    checks = [("shots_per_minute", result["shots_per_minute"], baseline.get("shots_per_minute"), True),
+              ("latency_p50", result["latency_p50"], baseline.get("latency_p50"), False),
+              ("latency_p95", result["latency_p95"], baseline.get("latency_p95"), False)]
+    checks += [(name, ms, baseline.get("stages", {}).get(name), False) for name, ms in result["stages"].items()]
+    for name, value, old, higher_is_better in checks:
+        if not old:
+            continue
+        change = (value - old) / old * 100
+        worse = -change if higher_is_better else change
+        # Short stages jitter by a few ms, more than any sensible tolerance
+        regression = worse > tolerance and (higher_is_better or abs(value - old) >= 10)
+        ok = ok and not regression
+        print(f"  {name:<18}{old:>10.1f} -> {value:>10.1f}  {change:+6.1f}%{'  REGRESSION' if regression else ''}")
+    return ok
+
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def legacy_crop_rotate(img, crop, rotation):
+    """The old take_image_cropped_rotated path - turn the whole frame, then cut the crop out of it"""
+    capture = Capture(img)
+    capture.rotate(rotation)
+    img = capture.image
+    left = (img.width - crop[0]) // 2
+    top = (img.height - crop[1]) // 2
+    return Capture(img.crop((left, top, left + crop[0], top + crop[1])))
+
+
+def bench_roi(args):
+    """Software rotate and crop of a full frame against a frame the camera has already cropped"""
+    if args.camera:
+        bench_roi_camera(args)
+        return
+
+    with open(args.image, "rb") as f:
+        jpeg_bytes = f.read()
+    full = Image.open(io.BytesIO(jpeg_bytes))
+    full.load()
+    roi = camera_roi(full.size, args.crop, args.rotation)
+    x, y, width, height = roi["scaler_crop"]
+    # Stand-in for what the camera pipeline hands over - only the crop, already flipped for 180
+    cropped = full.crop((x, y, x + width, y + height))
+    if roi["hflip"]:
+        cropped = cropped.transpose(Image.Transpose.ROTATE_180)
+    print(f"Frame {full.width}x{full.height}, crop {args.crop[0]}x{args.crop[1]} rotated {args.rotation}, "
+          f"best of {args.repeat}")
+    print(f"{'path':<28}{'ms':>10}{'frame MB':>10}")
+
+    def legacy():
+        # Decode the saved full resolution JPEG, as the old path did
+        img = Image.open(io.BytesIO(jpeg_bytes))
+        return legacy_crop_rotate(img, args.crop, args.rotation).jpeg()
+
+    def hardware():
+        capture = Capture(cropped)
+        capture.rotate(roi["rotate"])
+        return capture.jpeg()
+
+    # Frame memory held at the peak - the frame plus its rotated copy
+    ms, _ = time_call(legacy, args.repeat)
+    print(f"{'full frame rotate + crop':<28}{ms:>10.1f}{full.width * full.height * 3 * 2 / 1e6:>10.1f}")
+    ms, _ = time_call(hardware, args.repeat)
+    print(f"{'camera ROI':<28}{ms:>10.1f}{width * height * 3 * 2 / 1e6:>10.1f}")
+
+
+def bench_roi_camera(args):
+    from picamera2 import Picamera2
+    from libcamera import Transform
+
+    picam2 = Picamera2()
+    roi = camera_roi(picam2.camera_properties["PixelArraySize"], args.crop, args.rotation)
+    print(f"Camera crop {roi['size'][0]}x{roi['size'][1]}, rotated {args.rotation}, {args.repeat} shots each")
+    print(f"{'path':<28}{'ms':>10}{'process MB':>12}")
+
+    picam2.configure(picam2.create_still_configuration())
+    picam2.start()
+    time.sleep(2)
+
+    def legacy():
+        picam2.capture_file("temp.jpg")
+        with Image.open("temp.jpg") as img:
+            return legacy_crop_rotate(img, args.crop, args.rotation).jpeg()
+
+    ms, _ = time_call(legacy, args.repeat)
+    print(f"{'full frame rotate + crop':<28}{ms:>10.1f}{process_memory_mb() or 0:>12.0f}")
+    os.remove("temp.jpg")
+    picam2.stop()
+
+    picam2.configure(picam2.create_still_configuration(
+        main={"size": roi["size"]},
+        transform=Transform(hflip=roi["hflip"], vflip=roi["vflip"]),
+        controls={"ScalerCrop": roi["scaler_crop"]},
+    ))
+    picam2.start()
+    time.sleep(2)
+
+    def hardware():
+        capture = Capture.from_camera(picam2)
+        capture.rotate(roi["rotate"])
+        return capture.jpeg()
+
+    ms, _ = time_call(hardware, args.repeat)
+    print(f"{'camera ROI':<28}{ms:>10.1f}{process_memory_mb() or 0:>12.0f}")
+    picam2.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="StanzaCam benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    raster = commands.add_parser("raster", help="Raster encode time and output size")
+    raster.add_argument("image", help="Photo to encode (any size, resized to print width)")
+    raster.add_argument("--repeat", type=int, default=5)
+    raster.add_argument("--band-bytes", type=int, default=2048)
+    raster.add_argument("--trim-left", action="store_true", help="Also trim left margins in compact mode")
+    raster.set_defaults(func=bench_raster)
+
+    resize = commands.add_parser("resize", help="Print path downscale modes (PRINT_RESIZE)")
+    resize.add_argument("image", help="Photo to downscale")
+    resize.add_argument("--frame-width", type=int, default=2304, help="Scale the photo to this first (camera main stream)")
+    resize.add_argument("--repeat", type=int, default=5)
+    resize.set_defaults(func=bench_resize)
+
+    roi = commands.add_parser("roi", help="Camera crop and rotation against rotating and cropping a full frame")
+    roi.add_argument("image", nargs="?", help="Full resolution photo (not needed with --camera)")
+    roi.add_argument("--camera", action="store_true", help="Capture with the camera instead (on the Pi)")
+    roi.add_argument("--crop", type=parse_size, default=(1920, 1080), help="Crop after rotation, WIDTHxHEIGHT")
+    roi.add_argument("--rotation", type=int, default=270, help="Degrees counter-clockwise")
+    roi.add_argument("--repeat", type=int, default=3)
+    roi.set_defaults(func=bench_roi)
+
+    pipeline = commands.add_parser("pipeline", help="End to end shots on fake hardware and a mock API")
+    pipeline.add_argument("images", nargs="*", help="Photos for the fake camera (a test pattern if none)")
+    pipeline.add_argument("--shots", type=int, default=3)
+    pipeline.add_argument("--interval", type=float, default=0.0, help="Seconds between shots")
+    pipeline.add_argument("--latency", type=float, default=0.8, help="Mock API time to first token (s)")
+    pipeline.add_argument("--token-interval", type=float, default=0.02, help="Mock API time per token (s)")
+    pipeline.add_argument("--baud", type=int, default=9600, help="Printer serial rate")
+    pipeline.add_argument("--no-stream", action="store_true", help="Wait for the whole poem instead of streaming")
+    pipeline.add_argument("--save", help="Write the results to this JSON file")
+    pipeline.add_argument("--baseline", help="Compare with a saved run, exit 1 on a regression")
+    pipeline.add_argument("--tolerance", type=float, default=10.0, help="Percent worse that counts as a regression")
+    pipeline.add_argument("--verbose", action="store_true", help="Show the app's own output")
+    pipeline.set_defaults(func=bench_pipeline)
+
+    args = parser.parse_args()
+    if args.command == "roi" and not args.camera and not args.image:
+        parser.error("roi needs an image, or --camera")
+    args.func(args)
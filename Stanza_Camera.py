@@ -0,0 +1,266 @@
+# StanzaCam - Camera helpers
+
+import collections
+import io
+import threading
+import time
+from PIL import Image
+from Stanza_Image import sharpness
+from Stanza_Trace import Trace
+
+
+class Capture:
+    """One shot held in memory - the decoded frame plus its JPEG bytes, encoded on demand"""
+
+    def __init__(self, image, timestamp=None):
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        self.image = image
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.filename = f"capture_{time.strftime('%Y-%m-%d_%H-%M-%S', time.localtime(self.timestamp))}.jpg"
+        self._jpeg = None
+        self.upload_jpeg = None  # Downscaled copy sent to Claude, kept once it has been encoded
+        self.trace = Trace()  # Stage timings, replaced by one started at the button press for new shots
+
+    @classmethod
+    def from_camera(cls, picam2, stream="main"):
+        """Grab the next frame straight into memory (no file round-trip)"""
+        return cls(picam2.capture_image(stream))
+
+    @classmethod
+    def from_camera_mode(cls, picam2, camera_config, stream="main"):
+        """Switch to another configuration (e.g. full sensor resolution) for one frame, then back
+
+        The time the switch took is kept in switch_time.
+        """
+        start = time.time()
+        capture = cls(picam2.switch_mode_and_capture_image(camera_config, stream))
+        capture.switch_time = time.time() - start
+        return capture
+
+    @classmethod
+    def from_upload_jpeg(cls, jpeg_bytes, timestamp=None):
+        """Rebuild a capture from its upload-sized JPEG (e.g. one read back from the spool)"""
+        image = Image.open(io.BytesIO(jpeg_bytes))
+        image.load()
+        capture = cls(image, timestamp)
+        capture.upload_jpeg = jpeg_bytes
+        return capture
+
+    def rotate(self, degrees):
+        """Turn the frame by a multiple of 90 degrees counter-clockwise (before any JPEG is encoded)"""
+        transpose = _TRANSPOSE.get(degrees % 360)
+        if transpose is not None:
+            self.image = self.image.transpose(transpose)
+            self._jpeg = None
+            self.upload_jpeg = None
+
+    def jpeg(self, quality=90):
+        """Full resolution JPEG bytes, only encoded the first time they're needed"""
+        if self._jpeg is None:
+            buffer = io.BytesIO()
+            self.image.save(buffer, format="JPEG", quality=quality)
+            self._jpeg = buffer.getvalue()
+        return self._jpeg
+
+
+_TRANSPOSE = {90: Image.Transpose.ROTATE_90, 180: Image.Transpose.ROTATE_180, 270: Image.Transpose.ROTATE_270}
+
+
+def _even(value):
+    return max(2, int(value) // 2 * 2)
+
+
+def camera_roi(sensor_size, crop=None, rotation=0):
+    """Crop and orientation done by the camera pipeline instead of on a full resolution frame
+
+    crop is the (width, height) wanted after rotation, in sensor pixels and centred;
+    rotation is degrees counter-clockwise. Returns a dict with:
+      size        stream size to ask for (the crop as the sensor sees it), None for the full frame
+      scaler_crop ScalerCrop control (x, y, width, height), None for the full frame
+      hflip/vflip for libcamera's Transform (180 degrees)
+      rotate      what's left to do in software - the ISP can't transpose, so 90/270 is
+                  done on the already cropped frame
+    """
+    rotation %= 360
+    if rotation not in (0, 90, 180, 270):
+        raise ValueError(f"Rotation must be a multiple of 90 degrees, not {rotation}")
+    roi = {"size": None, "scaler_crop": None, "hflip": rotation == 180, "vflip": rotation == 180,
+           "rotate": rotation if rotation in (90, 270) else 0}
+    if crop:
+        width, height = crop if rotation in (0, 180) else (crop[1], crop[0])
+        width, height = _even(min(width, sensor_size[0])), _even(min(height, sensor_size[1]))
+        x, y = (sensor_size[0] - width) // 2, (sensor_size[1] - height) // 2
+        roi["size"] = (width, height)
+        roi["scaler_crop"] = (x, y, width, height)
+    return roi
+
+
+def fit_size(size, bounds):
+    """Largest even size with the aspect ratio of size that fits in bounds"""
+    scale = min(bounds[0] / size[0], bounds[1] / size[1])
+    return _even(size[0] * scale), _even(size[1] * scale)
+
+
+# Bytes per pixel for the formats we use, for when libcamera hasn't filled in framesize
+_BYTES_PER_PIXEL = {"RGB888": 3, "BGR888": 3, "XRGB8888": 4, "XBGR8888": 4, "YUV420": 1.5}
+
+
+def camera_buffer_bytes(camera_config):
+    """Memory taken by a configuration's frame buffers, as {stream: bytes}"""
+    buffers = camera_config.get("buffer_count", 1)
+    usage = {}
+    for stream in ("main", "lores", "raw"):
+        config = camera_config.get(stream)
+        if not config:
+            continue
+        framesize = config.get("framesize")
+        if not framesize:
+            width, height = config["size"]
+            framesize = int(width * height * _BYTES_PER_PIXEL.get(config.get("format"), 4))
+        usage[stream] = framesize * buffers
+    return usage
+
+
+def process_memory_mb():
+    """Resident memory of this process in MB (Linux only, None elsewhere)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class FocusTracker:
+    """Follows autofocus from the camera's per-frame callback, so the main loop never waits on a frame
+
+    Call on_frame() from picam2.post_callback. The camera counts as focused once AfState
+    reports focused and the lens has held still (within lens_tolerance dioptres) for
+    stable_frames frames in a row.
+    """
+
+    def __init__(self, picam2, stable_frames=3, lens_tolerance=0.05, on_change=None):
+        self.picam2 = picam2
+        self.stable_frames = stable_frames
+        self.lens_tolerance = lens_tolerance
+        self.on_change = on_change
+        self.lock = threading.Lock()
+        self.focused_event = threading.Event()
+        self.first_frame_event = threading.Event()  # Set once frames are coming in
+        self.lens_history = collections.deque(maxlen=stable_frames)
+        self.af_state = None
+        self.lens_position = None
+        self.focused = False
+        self.search_start = time.time()
+        self.time_to_focus = None  # Seconds from losing focus (or a reset/trigger) to getting it back
+        self.awaiting_scan = False  # After a trigger, ignore the old result until the new scan starts
+
+    def on_frame(self, request):
+        # Runs in the camera thread for every completed frame - keep it quick
+        if not self.first_frame_event.is_set():
+            self.first_frame_event.set()
+        metadata = request.get_metadata()
+        with self.lock:
+            self.af_state = metadata.get("AfState")
+            self.lens_position = metadata.get("LensPosition")
+            if self.lens_position is not None:
+                self.lens_history.append(self.lens_position)
+
+            stable = (len(self.lens_history) == self.stable_frames and
+                      max(self.lens_history) - min(self.lens_history) <= self.lens_tolerance)
+            if self.awaiting_scan and self.af_state == 1:  # 1 = Scanning
+                self.awaiting_scan = False
+            focused = self.af_state == 2 and stable and not self.awaiting_scan  # 2 = Focused
+
+            changed = focused != self.focused
+            self.focused = focused
+            if changed and focused:
+                self.time_to_focus = time.time() - self.search_start
+            elif changed:
+                self.search_start = time.time()
+
+        if changed:
+            if focused:
+                self.focused_event.set()
+            else:
+                self.focused_event.clear()
+            if self.on_change:
+                self.on_change(focused)
+
+    def is_focused(self):
+        return self.focused
+
+    def reset(self):
+        """Start over, e.g. after a capture - focus has to settle again before the next shot"""
+        with self.lock:
+            self.lens_history.clear()
+            self.focused = False
+            self.focused_event.clear()
+            self.search_start = time.time()
+            self.time_to_focus = None
+
+    def trigger(self):
+        """Start a single autofocus cycle (AfMode must be Auto), without waiting for it"""
+        self.reset()
+        self.awaiting_scan = True
+        self.picam2.set_controls({"AfTrigger": 0})  # 0 = Start
+
+    def wait_focused(self, timeout):
+        """Block until focused, returns False on timeout"""
+        return self.focused_event.wait(timeout)
+
+
+def frame_luma(request, stream):
+    """Luminance plane of a request's stream as a 2D array (downsampled for RGB streams)"""
+    array = request.make_array(stream)
+    if array.ndim == 2:
+        # YUV420 - the Y plane is the first two thirds of the rows
+        return array[:array.shape[0] * 2 // 3]
+    # RGB - every 4th pixel is plenty for judging blur, and the channel mean is close enough to luma
+    return array[::4, ::4, :3].mean(axis=2)
+
+
+class FrameRing:
+    """The last few camera frames, so a shot can be picked from frames taken just before the press
+
+    Call add() from picam2.post_callback. Each frame holds a camera buffer until it drops
+    out of the ring, so the configuration needs size extra buffers.
+    """
+
+    def __init__(self, size=3, score_stream="lores"):
+        self.size = size
+        self.score_stream = score_stream
+        self.frames = collections.deque()
+        self.lock = threading.Lock()
+
+    def add(self, request):
+        request.acquire()
+        with self.lock:
+            self.frames.append(request)
+            old = self.frames.popleft() if len(self.frames) > self.size else None
+        if old:
+            old.release()
+
+    def best_capture(self, stream="main"):
+        """Capture from the sharpest frame in the ring, or None if it's empty
+
+        The sharpness scores are kept on the capture in sharpness_scores.
+        """
+        with self.lock:
+            frames = list(self.frames)
+            self.frames.clear()
+        if not frames:
+            return None
+        try:
+            scores = [sharpness(frame_luma(frame, self.score_stream)) for frame in frames]
+            best = max(range(len(frames)), key=lambda i: scores[i])
+            capture = Capture(frames[best].make_image(stream))
+        finally:
+            for frame in frames:
+                frame.release()
+        capture.sharpness_scores = scores
+        capture.sharpness_index = best
+        return capture
@@ -0,0 +1,74 @@
+# StanzaCam - Claude API connection
+
+import threading
+import time
+
+KEEPALIVE_EXPIRY = 300.0  # Seconds an idle connection is kept in the pool (httpx default is only 5)
+
+
+class ClaudeConnection:
+    """One long-lived Anthropic client that keeps a warm HTTPS connection ready for the next shot"""
+
+    def __init__(self, api_key, keepalive_interval=20.0, base_url=None):
+        import anthropic  # Takes seconds on a Pi Zero, so it's only imported once the connection is made
+
+        # Built through the SDK - newer versions use their own copy of httpx and reject a plain httpx.Client
+        limits_type = type(anthropic.DEFAULT_CONNECTION_LIMITS)
+        self.http_client = anthropic.DefaultHttpxClient(
+            limits=limits_type(max_connections=4, max_keepalive_connections=4, keepalive_expiry=KEEPALIVE_EXPIRY),
+            timeout=anthropic.Timeout(120.0, connect=10.0),
+        )
+        # base_url None is the real API, anything else is e.g. the mock server in Stanza_Fakes
+        self.client = anthropic.Anthropic(api_key=api_key, base_url=base_url, http_client=self.http_client)
+        self.keepalive_interval = keepalive_interval
+        self.last_activity = 0.0
+        self.last_attempt = 0.0
+        self.online = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def is_warm(self):
+        """True if a pooled connection was used recently enough that it should still be open"""
+        return time.time() - self.last_activity < self.keepalive_interval * 1.5
+
+    def mark_used(self):
+        """Note that a request just went over the pooled connection"""
+        self.last_activity = time.time()
+
+    def warm_up(self):
+        """Open (or refresh) a connection to the API, returns the time taken in ms or None if offline"""
+        start = self.last_attempt = time.time()
+        try:
+            # Any response will do - it's the DNS, TCP and TLS setup we're after
+            self.http_client.head(str(self.client.base_url))
+        except Exception as e:  # Any transport error means we're offline
+            if self.online is not False:
+                print(f"ERROR: Could not reach Claude API - {e}")
+            self.online = False
+            return None
+
+        setup_ms = (time.time() - start) * 1000
+        if not self.online:
+            print(f"Claude API connection ready ({setup_ms:.0f} ms to connect)")
+        self.online = True
+        self.mark_used()
+        return setup_ms
+
+    def start_keepalive(self):
+        """Warm up now and keep the connection alive in the background"""
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._keepalive_worker, daemon=True)
+        self.thread.start()
+
+    def stop_keepalive(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=1.0)
+
+    def _keepalive_worker(self):
+        if not self.last_attempt:
+            self.warm_up()  # Unless the caller has just done it
+        while not self.stop_event.wait(1.0):
+            # Use whichever is later so an offline booth retries at the same slow rate
+            if time.time() - max(self.last_activity, self.last_attempt) >= self.keepalive_interval:
+                self.warm_up()
@@ -0,0 +1,500 @@
+# StanzaCam - Fake hardware
+#
+# Stand-ins for everything Stanza_Main talks to, so the whole pipeline runs on any
+# Linux box (see the pipeline benchmark in Stanza_Bench.py):
+#   FakeGPIO          RPi.GPIO with inputs that can be set or scripted
+#   FakeCamera        Picamera2 serving frames from image files, with a simulated autofocus
+#   FakePrinterPort   pyserial port for the thermal printer - as slow as the real baud rate,
+#                     with a printer buffer that fills up and drives the DTR busy line
+#   MockClaudeServer  local Messages API (streaming and not) with adjustable latency
+#
+#   import Stanza_Main, Stanza_Fakes
+#   gpio = Stanza_Fakes.FakeGPIO()
+#   server = Stanza_Fakes.MockClaudeServer(latency=0.8).start()
+#   Stanza_Main.setup(gpio=gpio, camera=Stanza_Fakes.FakeCamera(["photo.jpg"]),
+#                     printer_port=Stanza_Fakes.FakePrinterPort(gpio=gpio, busy_pin=Stanza_Main.DTR),
+#                     api_base_url=server.base_url)
+
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from PIL import Image
+
+from Stanza_Printer import STATUS_REQUEST
+
+DEFAULT_POEM = """Light pools on the table,
+a cup, a hand, a pause -
+the shutter keeps the moment
+the room forgot it was."""
+
+
+class FakeGPIO:
+    """RPi.GPIO stand-in - outputs are recorded, inputs are set with set_input() or a script"""
+
+    BCM = "BCM"
+    BOARD = "BOARD"
+    IN = "in"
+    OUT = "out"
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self.levels = {}
+        self.modes = {}
+        self.callbacks = {}
+        self.output_log = []  # (time, pin, level) for every output write
+        self.lock = threading.Lock()
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, mode, pull_up_down=None, initial=None):
+        with self.lock:
+            self.modes[pin] = mode
+            if initial is not None:
+                self.levels[pin] = initial
+            else:
+                self.levels.setdefault(pin, self.HIGH if pull_up_down == self.PUD_UP else self.LOW)
+
+    def output(self, pin, level):
+        with self.lock:
+            self.levels[pin] = level
+            self.output_log.append((time.time(), pin, level))
+
+    def input(self, pin):
+        return self.levels.get(pin, self.LOW)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self.callbacks[pin] = (edge, callback)
+
+    def remove_event_detect(self, pin):
+        self.callbacks.pop(pin, None)
+
+    def cleanup(self):
+        self.callbacks.clear()
+
+    def set_input(self, pin, level):
+        """Drive an input pin, running its edge callback like the real library would"""
+        with self.lock:
+            old = self.levels.get(pin, self.LOW)
+            self.levels[pin] = level
+        edge, callback = self.callbacks.get(pin, (None, None))
+        if callback and level != old:
+            if edge == self.BOTH or edge == (self.RISING if level else self.FALLING):
+                callback(pin)
+
+    def press(self, pin, hold=0.1, bounces=0):
+        """Press and release a button, optionally with contact bounce on the way down"""
+        for _ in range(bounces):
+            self.set_input(pin, self.HIGH)
+            time.sleep(0.001)
+            self.set_input(pin, self.LOW)
+            time.sleep(0.001)
+        self.set_input(pin, self.HIGH)
+        time.sleep(hold)
+        self.set_input(pin, self.LOW)
+
+    def set_rotary(self, pins, position):
+        """Move a rotary switch (list of pins for positions 1, 2, ...) to position"""
+        for i, pin in enumerate(pins, start=1):
+            if i != position:
+                self.set_input(pin, self.LOW)
+        self.set_input(pins[position - 1], self.HIGH)
+
+    def run_script(self, steps):
+        """Play (delay, pin, level) steps in a background thread, returns the thread"""
+        def worker():
+            for delay, pin, level in steps:
+                time.sleep(delay)
+                self.set_input(pin, level)
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        return thread
+
+
+class FakeTransform:
+    """libcamera.Transform stand-in"""
+
+    def __init__(self, hflip=False, vflip=False):
+        self.hflip = bool(hflip)
+        self.vflip = bool(vflip)
+
+
+class FakeRequest:
+    """One completed camera frame, like picamera2's CompletedRequest"""
+
+    def __init__(self, camera, frame, metadata):
+        self.camera = camera
+        self.frame = frame  # {stream: PIL image}
+        self.metadata = metadata
+        self.refs = 1
+
+    def get_metadata(self):
+        return dict(self.metadata)
+
+    def acquire(self):
+        self.refs += 1
+
+    def release(self):
+        self.refs -= 1
+
+    def make_image(self, stream="main"):
+        return self.frame[stream].copy()
+
+    def make_array(self, stream="main"):
+        img = self.frame[stream]
+        if stream == "lores":
+            # YUV420 like the real lores stream - the Y plane then quarter size U and V planes
+            y = np.asarray(img.convert("L"))
+            chroma = np.full((y.shape[0] // 2, y.shape[1]), 128, dtype=np.uint8)
+            return np.vstack([y, chroma])
+        return np.asarray(img)
+
+
+class FakeCamera:
+    """Picamera2 stand-in that serves frames from image files in a loop
+
+    Frames are delivered to post_callback at fps. Autofocus is simulated: after
+    start() (continuous AF) or an AfTrigger, scan_frames frames report scanning
+    with the lens moving, then it reports focused.
+    """
+
+    Transform = FakeTransform  # Used in place of libcamera.Transform where libcamera isn't installed
+
+    def __init__(self, paths=(), sensor_size=(4608, 2592), fps=30.0, scan_frames=10, switch_delay=0.6):
+        self.sources = [Image.open(path).convert("RGB") for path in paths]
+        if not self.sources:
+            # Something with detail in it, so sharpness and dithering have work to do
+            self.sources = [Image.effect_mandelbrot(sensor_size, (-2.0, -1.2, 1.0, 1.2), 60).convert("RGB")]
+        self.camera_properties = {"PixelArraySize": sensor_size, "Model": "fake"}
+        self.fps = fps
+        self.scan_frames = scan_frames
+        self.switch_delay = switch_delay
+        self.camera_config = None
+        self.controls = {}
+        self.post_callback = None
+        self.frame_count = 0
+        self.scan_remaining = 0
+        self.lens_position = 1.0
+        self.cache = {}
+        self.latest = None
+        self.frame_ready = threading.Condition()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def _configuration(self, main, lores, buffer_count, transform, controls):
+        config = {"main": {"size": tuple(main.get("size") or self.camera_properties["PixelArraySize"]),
+                           "format": main.get("format", "BGR888")},
+                  "buffer_count": buffer_count, "transform": transform, "controls": dict(controls or {})}
+        if lores:
+            config["lores"] = {"size": tuple(lores["size"]), "format": "YUV420"}
+        return config
+
+    def create_still_configuration(self, main=None, lores=None, buffer_count=1, transform=None, controls=None, **kwargs):
+        return self._configuration(main or {}, lores, buffer_count, transform, controls)
+
+    def create_preview_configuration(self, main=None, lores=None, buffer_count=4, transform=None, controls=None, **kwargs):
+        main = dict(main or {})
+        main.setdefault("size", (640, 480))
+        return self._configuration(main, lores, buffer_count, transform, controls)
+
+    def configure(self, config):
+        self.camera_config = config
+        self.controls.update(config.get("controls", {}))
+
+    def set_controls(self, controls):
+        self.controls.update(controls)
+        if "AfTrigger" in controls or controls.get("AfMode") == 2:
+            self.scan_remaining = self.scan_frames
+
+    def _frame(self, config):
+        # Frames are cached per configuration, the source cycles through the files
+        index = self.frame_count % len(self.sources)
+        key = (index, config["main"]["size"], config.get("lores", {}).get("size"), config.get("controls", {}).get("ScalerCrop"))
+        if key not in self.cache:
+            source = self.sources[index]
+            crop = config.get("controls", {}).get("ScalerCrop")
+            if crop:
+                # Sensor coordinates to source image coordinates
+                sx = source.width / self.camera_properties["PixelArraySize"][0]
+                sy = source.height / self.camera_properties["PixelArraySize"][1]
+                x, y, w, h = crop
+                source = source.crop((round(x * sx), round(y * sy), round((x + w) * sx), round((y + h) * sy)))
+            frame = {"main": source.resize(config["main"]["size"], Image.BILINEAR)}
+            if "lores" in config:
+                frame["lores"] = source.resize(config["lores"]["size"], Image.BILINEAR)
+            self.cache[key] = frame
+        return self.cache[key]
+
+    def _metadata(self):
+        if self.scan_remaining > 0:
+            self.scan_remaining -= 1
+            self.lens_position = 1.0 + 0.3 * self.scan_remaining
+            return {"AfState": 1, "LensPosition": self.lens_position}  # Scanning
+        return {"AfState": 2, "LensPosition": self.lens_position}  # Focused
+
+    def start(self):
+        self.stop_event.clear()
+        if self.controls.get("AfMode") == 2:
+            self.scan_remaining = self.scan_frames
+        self.thread = threading.Thread(target=self._frame_worker, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=1.0)
+
+    def close(self):
+        self.stop()
+
+    def _frame_worker(self):
+        interval = 1.0 / self.fps
+        next_frame = time.time()
+        while not self.stop_event.is_set():
+            request = FakeRequest(self, self._frame(self.camera_config), self._metadata())
+            self.frame_count += 1
+            if self.post_callback:
+                self.post_callback(request)
+            with self.frame_ready:
+                self.latest = request
+                self.frame_ready.notify_all()
+            request.release()
+            next_frame += interval
+            time.sleep(max(0.0, next_frame - time.time()))
+
+    def capture_request(self):
+        """The next frame to arrive"""
+        with self.frame_ready:
+            count = self.frame_count
+            self.frame_ready.wait_for(lambda: self.frame_count > count, timeout=2.0)
+            return self.latest
+
+    def capture_image(self, stream="main"):
+        return self.capture_request().make_image(stream)
+
+    def switch_mode_and_capture_image(self, camera_config, stream="main"):
+        time.sleep(self.switch_delay)  # Reconfiguring the real sensor takes this long
+        return self._frame(camera_config)[stream].copy()
+
+
+class FakePrinterPort:
+    """pyserial stand-in for the thermal printer
+
+    Writes take as long as they would on the wire (10 bits per byte at baudrate).
+    Received bytes go into a printer buffer of buffer_size bytes that drains at
+    print_rate bytes per second; with a gpio and busy_pin the busy (DTR) line goes
+    high when the buffer is busy_fill full. Bytes that arrive with the buffer full
+    are lost, like on the real printer, and counted in overflow_bytes.
+    """
+
+    def __init__(self, baudrate=9600, printer_baudrate=None, buffer_size=4096, print_rate=10000,
+                 gpio=None, busy_pin=None, busy_fill=0.75, timeout=1):
+        self.baudrate = baudrate
+        self.printer_baudrate = printer_baudrate or baudrate  # The rate the printer itself is set to
+        self.buffer_size = buffer_size
+        self.print_rate = print_rate
+        self.gpio = gpio
+        self.busy_pin = busy_pin
+        self.busy_fill = busy_fill
+        self.timeout = timeout
+        self.received = bytearray()  # Everything the printer got, for checking receipts
+        self.overflow_bytes = 0
+        self.buffer_level = 0.0
+        self.max_buffer_level = 0.0
+        self.replies = bytearray()
+        self.lock = threading.Lock()
+        self.last_drain = time.time()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._drain_worker, daemon=True)
+        self.thread.start()
+
+    def _drain(self):
+        # Called with the lock held
+        now = time.time()
+        self.buffer_level = max(0.0, self.buffer_level - (now - self.last_drain) * self.print_rate)
+        self.last_drain = now
+        if self.gpio and self.busy_pin is not None:
+            busy = self.buffer_level >= self.buffer_size * self.busy_fill
+            if busy != (self.gpio.input(self.busy_pin) == self.gpio.HIGH):
+                self.gpio.set_input(self.busy_pin, self.gpio.HIGH if busy else self.gpio.LOW)
+
+    def _drain_worker(self):
+        while not self.stop_event.wait(0.002):
+            with self.lock:
+                self._drain()
+
+    def write(self, data):
+        data = bytes(data)
+        # Small slices so the buffer and busy line move while a big write is on the wire
+        for offset in range(0, len(data), 16):
+            piece = data[offset:offset + 16]
+            time.sleep(len(piece) * 10 / self.baudrate)
+            with self.lock:
+                self._drain()
+                if self.baudrate != self.printer_baudrate:
+                    continue  # Wrong rate - the printer only sees noise
+                room = max(0, int(self.buffer_size - self.buffer_level))
+                self.overflow_bytes += max(0, len(piece) - room)
+                self.buffer_level += min(len(piece), room)
+                self.max_buffer_level = max(self.max_buffer_level, self.buffer_level)
+                self.received += piece
+                if STATUS_REQUEST in self.received[-len(piece) - len(STATUS_REQUEST):]:
+                    self.replies.append(0x12)  # Online, no errors
+        return len(data)
+
+    def flush(self):
+        pass  # Writes are already paced to the wire
+
+    def read(self, size=1):
+        deadline = time.time() + (self.timeout or 0)
+        while True:
+            with self.lock:
+                if self.replies:
+                    data = bytes(self.replies[:size])
+                    del self.replies[:size]
+                    return data
+            if time.time() >= deadline:
+                return b""
+            time.sleep(0.005)
+
+    @property
+    def in_waiting(self):
+        return len(self.replies)
+
+    def reset_input_buffer(self):
+        with self.lock:
+            self.replies.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        self.stop_event.set()
+
+
+class MockClaudeServer:
+    """Local Messages API for benchmarks - answers every request with the same poem
+
+    latency is the time to the first token, then each token follows after token_interval.
+    model_latency ({model: seconds}) overrides latency for some models. A status other
+    than 200 answers with that API error instead (e.g. 529 overloaded).
+    """
+
+    def __init__(self, poem=DEFAULT_POEM, latency=0.8, token_interval=0.02, status=200, port=0, model_latency=None):
+        self.poem = poem
+        self.latency = latency
+        self.model_latency = model_latency or {}
+        self.token_interval = token_interval
+        self.status = status
+        self.requests = 0
+        self.models = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def tokens(self):
+        return re.findall(r"\S+\s*|\s+", self.poem)
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like the real API
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                mock.requests += 1
+                mock.models.append(body.get("model"))
+                time.sleep(mock.model_latency.get(body.get("model"), mock.latency))
+
+                if mock.status != 200:
+                    self._send_json(mock.status, {"type": "error", "error": {
+                        "type": "overloaded_error" if mock.status == 529 else "api_error", "message": "Mock error"}})
+                    return
+
+                if body.get("stream"):
+                    try:
+                        self._stream(body.get("model"))
+                    except (BrokenPipeError, ConnectionResetError):
+                        self.close_connection = True  # The client closed the stream early, like a cancelled request
+                else:
+                    time.sleep(mock.token_interval * len(mock.tokens()))
+                    self._send_json(200, {
+                        "id": "msg_mock", "type": "message", "role": "assistant", "model": body.get("model"),
+                        "content": [{"type": "text", "text": mock.poem}],
+                        "stop_reason": "end_turn", "stop_sequence": None,
+                        "usage": {"input_tokens": 1000, "output_tokens": len(mock.tokens())},
+                    })
+
+            def _send_json(self, status, payload):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _event(self, name, payload):
+                data = f"event: {name}\ndata: {json.dumps(payload)}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            def _stream(self, model):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                tokens = mock.tokens()
+                self._event("message_start", {"type": "message_start", "message": {
+                    "id": "msg_mock", "type": "message", "role": "assistant", "model": model, "content": [],
+                    "stop_reason": None, "stop_sequence": None, "usage": {"input_tokens": 1000, "output_tokens": 1}}})
+                self._event("content_block_start", {"type": "content_block_start", "index": 0,
+                                                    "content_block": {"type": "text", "text": ""}})
+                for i, token in enumerate(tokens):
+                    if i:
+                        time.sleep(mock.token_interval)
+                    self._event("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                        "delta": {"type": "text_delta", "text": token}})
+                self._event("content_block_stop", {"type": "content_block_stop", "index": 0})
+                self._event("message_delta", {"type": "message_delta",
+                                              "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                              "usage": {"output_tokens": len(tokens)}})
+                self._event("message_stop", {"type": "message_stop"})
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+        return Handler
@@ -0,0 +1,148 @@
+# StanzaCam - Hedged requests
+#
+# A slow request is usually just unlucky (a busy server, a long queue for a big model),
+# and a second request sent a little later often beats it. HedgedRace runs a call and,
+# if it hasn't started answering within hedge_delay, the same call with a backup
+# argument (e.g. a faster model) as well. Whichever starts answering first wins and
+# the other is cancelled. A deadline caps the whole race, cutting off an answer that's
+# still going when it runs out.
+
+import threading
+import time
+
+
+class Attempt:
+    """One call in a race - the call reports its first output with claim()"""
+
+    def __init__(self, race, arg):
+        self.race = race
+        self.arg = arg
+        self.start = time.time()
+        self.cancel_event = threading.Event()
+        self.result = None
+        self.finished = False
+        self.lock = threading.Lock()
+        self._abort = None
+
+    def claim(self):
+        """Call when the first of the answer arrives - True if this attempt has won the race"""
+        return self.race._claim(self)
+
+    def on_abort(self, abort):
+        """Register a function that stops the call early (e.g. closes its response stream)"""
+        with self.lock:
+            self._abort = abort
+            cancelled = self.cancel_event.is_set()
+        if cancelled:
+            self._call_abort(abort)
+
+    def cancel(self):
+        with self.lock:
+            self.cancel_event.set()
+            abort = self._abort
+        if abort:
+            self._call_abort(abort)
+
+    def _call_abort(self, abort):
+        try:
+            abort()
+        except Exception:
+            pass  # Already finished or closed
+
+
+class HedgedRace:
+    """Primary call with a delayed backup, first to answer wins
+
+    call(arg, attempt) runs in its own thread, must call attempt.claim() when its first
+    output arrives (and only pass output on if that returns True), should stop once
+    attempt.cancel_event is set, and returns its result. A primary that finishes
+    without winning (e.g. an error) starts the backup straight away.
+    """
+
+    def __init__(self, call, hedge_delay=None, deadline=None, cancel_event=None):
+        self.call = call
+        self.hedge_delay = hedge_delay  # None - never send the backup just for being slow
+        self.deadline = deadline        # None - no limit
+        self.cancel_event = cancel_event
+        self.condition = threading.Condition()
+        self.attempts = []
+        self.winner = None
+        self.timed_out = False
+
+    def _claim(self, attempt):
+        with self.condition:
+            if self.winner is None and not attempt.cancel_event.is_set():
+                self.winner = attempt
+                self.condition.notify_all()
+            return self.winner is attempt
+
+    def _start(self, arg):
+        attempt = Attempt(self, arg)
+        self.attempts.append(attempt)
+        threading.Thread(target=self._run, args=(attempt,), daemon=True).start()
+        return attempt
+
+    def _run(self, attempt):
+        result = None
+        try:
+            result = self.call(attempt.arg, attempt)
+        finally:
+            with self.condition:
+                attempt.result = result
+                attempt.finished = True
+                self.condition.notify_all()
+
+    def run(self, primary, backup=None):
+        """Race primary (and backup if needed), returns the attempt whose result to use
+
+        That's the winner, or the primary if nothing won (its result has the error).
+        Returns None if the race was cancelled, or ran out of time before anything
+        answered. If time runs out part way through an answer, timed_out is set and
+        the winner is returned but cancelled - whatever it passed on so far is all of it.
+        """
+        start = time.time()
+        with self.condition:
+            self._start(primary)
+            while True:
+                if self.cancel_event and self.cancel_event.is_set():
+                    break
+                now = time.time()
+                if (self.deadline is not None and now - start >= self.deadline and
+                        not (self.winner and self.winner.finished)):  # Made it just in time
+                    self.timed_out = True
+                    break
+                if self.winner is not None:
+                    if self.winner.finished:
+                        break
+                elif all(attempt.finished for attempt in self.attempts):
+                    if backup is None or len(self.attempts) > 1:
+                        break
+                    self._start(backup)  # The primary failed outright - no point waiting
+                    continue
+                elif (backup is not None and len(self.attempts) == 1 and
+                      self.hedge_delay is not None and now - start >= self.hedge_delay):
+                    self._start(backup)
+                    continue
+
+                # Sleep until an attempt claims or finishes, or the next timer is due
+                timeouts = []
+                if self.deadline is not None:
+                    timeouts.append(start + self.deadline - now)
+                if (backup is not None and len(self.attempts) == 1 and self.hedge_delay is not None and
+                        self.winner is None):  # Once the primary is answering the timer has passed for good
+                    timeouts.append(start + self.hedge_delay - now)
+                if self.cancel_event:
+                    timeouts.append(0.1)  # A plain Event can't wake the condition, so look now and then
+                self.condition.wait(max(0.0, min(timeouts)) if timeouts else None)
+
+            if self.cancel_event and self.cancel_event.is_set():
+                losers, used = list(self.attempts), None
+            elif self.timed_out:
+                losers, used = list(self.attempts), self.winner
+            else:
+                used = self.winner or self.attempts[0]
+                losers = [attempt for attempt in self.attempts if attempt is not used]
+
+        for attempt in losers:
+            attempt.cancel()
+        return used
@@ -0,0 +1,103 @@
+# StanzaCam - Image helpers
+
+import io
+import numpy as np
+from PIL import Image
+
+MIN_UPLOAD_QUALITY = 40  # Below this JPEG artifacts start to confuse the vision model
+MIN_UPLOAD_EDGE = 256
+
+
+def encode_for_upload(img, max_edge=1568, max_bytes=500000, quality=85):
+    """Downscale and JPEG encode an image until it fits the upload byte budget
+
+    Returns (jpeg_bytes, (width, height), quality)
+    """
+    scale = min(1.0, max_edge / max(img.size))
+    target = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+
+    # Let the JPEG decoder do most of the shrinking (DCT scaling) if the image hasn't been loaded yet
+    if img.format == "JPEG":
+        img.draft("RGB", target)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    while True:
+        if img.size != target:
+            resized = img.resize(target, Image.BICUBIC, reducing_gap=2.0)
+        else:
+            resized = img
+
+        # Step the quality down until it fits, then fall back to shrinking the image further
+        q = quality
+        while True:
+            buffer = io.BytesIO()
+            resized.save(buffer, format="JPEG", quality=q, optimize=True)
+            data = buffer.getvalue()
+            if len(data) <= max_bytes or q <= MIN_UPLOAD_QUALITY:
+                break
+            q = max(MIN_UPLOAD_QUALITY, q - 10)
+
+        if len(data) <= max_bytes or max(target) <= MIN_UPLOAD_EDGE:
+            return data, resized.size, q
+
+        target = (max(1, round(target[0] * 0.75)), max(1, round(target[1] * 0.75)))
+
+
+def sharpness(gray):
+    """Variance of the Laplacian of a 2D luminance array - higher means sharper (less blur)"""
+    g = np.asarray(gray, dtype=np.float32)
+    laplacian = 4 * g[1:-1, 1:-1] - g[:-2, 1:-1] - g[2:, 1:-1] - g[1:-1, :-2] - g[1:-1, 2:]
+    return float(laplacian.var())
+
+
+PRINT_RESIZE_MODES = ("fast", "balanced", "best")
+
+
+def resize_for_print(img, width, mode="balanced"):
+    """Grayscale copy of an image scaled to the print width
+
+    The printer only uses luminance, so the image is converted to grayscale before
+    resampling (a third of the work). Modes trade quality for speed:
+      fast      box reduce by a whole factor, then bilinear to the exact size
+      balanced  box reduce to within 2x of the target, then Lanczos
+      best      one Lanczos pass from full resolution (slowest)
+    """
+    if mode not in PRINT_RESIZE_MODES:
+        raise ValueError(f"Unknown print resize mode {mode!r}, use one of {', '.join(PRINT_RESIZE_MODES)}")
+    target = (width, max(1, round(width * img.height / img.width)))
+
+    # JPEGs that haven't been loaded yet can be decoded straight to grayscale at a fraction of the size
+    # ("best" keeps the full resolution and only skips the colour)
+    if img.format == "JPEG":
+        img.draft("L", img.size if mode == "best" else target)
+    if img.mode != "L":
+        img = img.convert("L")
+
+    if mode == "fast":
+        factor = img.width // target[0]
+        if factor > 1:
+            img = img.reduce(factor)
+        return img.resize(target, Image.BILINEAR) if img.size != target else img
+    if mode == "balanced":
+        return img.resize(target, Image.LANCZOS, reducing_gap=2.0)
+    return img.resize(target, Image.LANCZOS)
+
+
+def dhash(img, size=8):
+    """Difference hash of an image as a size*size bit int - near-identical frames differ in only a few bits
+
+    Each bit says whether a pixel of a tiny grayscale copy is brighter than its left
+    neighbour, so it survives small changes in exposure, noise and JPEG artifacts.
+    """
+    small = img.resize((size + 1, size), Image.BOX)
+    if small.mode != "L":
+        small = small.convert("L")
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a, b):
+    """Number of bits that differ between two hashes"""
+    return bin(a ^ b).count("1")
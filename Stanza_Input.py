@@ -0,0 +1,126 @@
+# StanzaCam - Pushbutton and rotary switch input
+#
+# Edge callbacks instead of polling. Every edge is debounced in software and the
+# settled result is published on a queue as (kind, number, value) events:
+#   ("button", 1, 1)   pressed
+#   ("button", 1, 0)   released
+#   ("rotary", 2, 5)   rotary switch 2 moved to position 5
+
+import queue
+import threading
+import time
+
+
+class InputEvents:
+    """Debounced, edge-triggered button and rotary switch events"""
+
+    def __init__(self, gpio, button_pin, rotary_pins, debounce=0.02):
+        self.gpio = gpio
+        self.button_pin = button_pin
+        self.rotary_pins = rotary_pins  # {switch number: [pin for position 1, 2, ...]}
+        self.debounce = debounce
+        self.events = queue.Queue()
+        self.lock = threading.Lock()
+        self.lockout = {}  # Group -> time until which further edges only schedule a settle check
+
+        # Current settled state
+        self.button = self._read("button", 1)
+        self.rotary = {num: self._read("rotary", num) for num in rotary_pins}
+
+        self.group_of_pin = {button_pin: ("button", 1)}
+        for num, pins in rotary_pins.items():
+            for pin in pins:
+                self.group_of_pin[pin] = ("rotary", num)
+
+        try:
+            for pin in self.group_of_pin:
+                gpio.add_event_detect(pin, gpio.BOTH, callback=self._on_edge)
+            self.polling = False
+        except RuntimeError as e:
+            # Some kernel/RPi.GPIO combinations can't do edge detection - fall back to a polling thread
+            print(f"ERROR: GPIO edge detection unavailable ({e}), polling inputs instead")
+            for pin in self.group_of_pin:
+                try:
+                    gpio.remove_event_detect(pin)
+                except RuntimeError:
+                    pass
+            self.polling = True
+            threading.Thread(target=self._poll_worker, daemon=True).start()
+
+    def _read(self, kind, num):
+        if kind == "button":
+            return 1 if self.gpio.input(self.button_pin) == self.gpio.HIGH else 0
+        for i, pin in enumerate(self.rotary_pins[num], start=1):
+            if self.gpio.input(pin) == self.gpio.HIGH:
+                return i
+        return 0  # Between detents
+
+    def _on_edge(self, pin):
+        group = self.group_of_pin[pin]
+        now = time.time()
+        with self.lock:
+            in_lockout = now < self.lockout.get(group, 0)
+            if not in_lockout:
+                self.lockout[group] = now + self.debounce
+        if in_lockout:
+            return  # Bounce - the settle check at the end of the lockout picks up the final state
+
+        # Leading edge - publish straight away so a press is seen within the callback,
+        # then look again once the contacts have stopped bouncing
+        self._update(group)
+        timer = threading.Timer(self.debounce, self._update, args=(group,))
+        timer.daemon = True
+        timer.start()
+
+    def _update(self, group):
+        kind, num = group
+        value = self._read(kind, num)
+        with self.lock:
+            if kind == "button":
+                if value == self.button:
+                    return
+                self.button = value
+            else:
+                # Rotary switches read 0 between detents, keep the last real position
+                if value == 0 or value == self.rotary[num]:
+                    return
+                self.rotary[num] = value
+        self.events.put((kind, num, value))
+
+    def _poll_worker(self):
+        while True:
+            for group in set(self.group_of_pin.values()):
+                self._update(group)
+            time.sleep(self.debounce)
+
+    def get(self, timeout=None):
+        """Next event, or None if there wasn't one within timeout"""
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def clear(self):
+        """Throw away events that haven't been handled yet"""
+        while self.get(timeout=0) is not None:
+            pass
+
+    def held_for(self, seconds, since):
+        """True if the button is still down seconds after since, returns early once it's released"""
+        while self.button:
+            remaining = since + seconds - time.time()
+            if remaining <= 0:
+                return True
+            time.sleep(min(remaining, 0.02))
+        return False
+
+    def wait_for_press(self, timeout):
+        """Wait for a new button press, returns True if there was one before the timeout"""
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            event = self.get(timeout=remaining)
+            if event == ("button", 1, 1):
+                return True
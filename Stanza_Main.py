@@ -1,15 +1,25 @@
 # StanzaCam V1.21 - 23/01/26
 
 import time
-import RPi.GPIO as GPIO
+startup_start = time.time()  # For the startup timing breakdown
 import os
 import base64
 import threading
+import queue
+import sqlite3
 os.environ["LIBCAMERA_LOG_LEVELS"] = "ERROR"  # Only show errors, not INFO
-from picamera2 import Picamera2
-from escpos.printer import Serial
-from PIL import Image
-import anthropic
+# anthropic, escpos, picamera2 and the numpy/PIL based Stanza_Image, Stanza_Camera and
+# Stanza_Raster take seconds to import on a Pi Zero - they're imported where they're used,
+# which for all of them is first in setup's start-up threads, at the same time as each other
+from Stanza_Receipt import FONT_COLUMNS, PoemLineAssembler, Receipt
+from Stanza_Claude import ClaudeConnection
+from Stanza_Printer import SerialTransport, detect_baud_rate, request_status, ENABLE_DTR
+from Stanza_Spool import Spool
+from Stanza_Archive import Archive
+from Stanza_Reprint import ReceiptCache
+from Stanza_Trace import Trace, TraceLog
+from Stanza_Hedge import HedgedRace
+from Stanza_Input import InputEvents
 
 # Import configuration
 try:
@@ -21,6 +31,62 @@ except ImportError:
     POEM_PROMPTS = {1: "Write a short poem about this image."}
     CLAUDE_MODELS = {1: "claude-haiku-4-5-20251001", 2: "claude-sonnet-4-5-20250929"}
 
+# Optional settings - older config.py files may not have these, so fall back to defaults
+try:
+    import config as user_config
+except ImportError:
+    user_config = None
+
+UPLOAD_MAX_EDGE = getattr(user_config, "UPLOAD_MAX_EDGE", 1568)      # Long edge of the image sent to Claude (px)
+UPLOAD_MAX_BYTES = getattr(user_config, "UPLOAD_MAX_BYTES", 500000)  # Byte budget for the uploaded JPEG
+UPLOAD_JPEG_QUALITY = getattr(user_config, "UPLOAD_JPEG_QUALITY", 85)
+ARCHIVE_CAPTURES = getattr(user_config, "ARCHIVE_CAPTURES", False)  # Archive every shot, not just the ARCHIVE_MODEL_POSITIONS ones
+ARCHIVE_MODEL_POSITIONS = getattr(user_config, "ARCHIVE_MODEL_POSITIONS", (3, 4))  # Rotary 2 positions that save to file
+ARCHIVE_DIR = getattr(user_config, "ARCHIVE_DIR", "captures")  # Photos (by content hash) and the catalog.db of every shot
+SPECULATIVE_POEM = getattr(user_config, "SPECULATIVE_POEM", False)  # Request the poem while waiting for print confirmation
+STREAM_POEM = getattr(user_config, "STREAM_POEM", True)  # Print the poem line by line as it is generated
+HEDGE_DELAY = getattr(user_config, "HEDGE_DELAY", None)  # Seconds without any poem text before also asking HEDGE_MODEL, None for off
+HEDGE_MODEL = getattr(user_config, "HEDGE_MODEL", None)  # Backup model, None for the Haiku model in CLAUDE_MODELS
+POEM_DEADLINE = getattr(user_config, "POEM_DEADLINE", None)  # Longest wait for the poem in seconds, None for no limit
+POEM_CACHE = getattr(user_config, "POEM_CACHE", False)  # Reuse the poem for a near-identical frame with the same prompt and model
+POEM_CACHE_FILE = getattr(user_config, "POEM_CACHE_FILE", "poem_cache.json")
+POEM_CACHE_DISTANCE = getattr(user_config, "POEM_CACHE_DISTANCE", 6)  # Bits (of 64) frames can differ by and still match
+POEM_CACHE_TTL = getattr(user_config, "POEM_CACHE_TTL", 3600)  # Seconds a cached poem can be reused for, None for no limit
+POEM_CACHE_SIZE = getattr(user_config, "POEM_CACHE_SIZE", 200)  # Poems kept, least recently used go first
+CLAUDE_KEEPALIVE_INTERVAL = getattr(user_config, "CLAUDE_KEEPALIVE_INTERVAL", 20)  # Seconds between connection keep-alives
+IMAGE_PRINT_MODE = getattr(user_config, "IMAGE_PRINT_MODE", "raster")  # "raster" (Stanza_Raster) or "escpos" (bitImageColumn)
+RECEIPT_FONT = getattr(user_config, "RECEIPT_FONT", "a")  # Poem font - "a" (32 columns) or "b" (smaller, 42 columns)
+RECEIPT_HEADER = getattr(user_config, "RECEIPT_HEADER", None)  # Line printed above the photo, e.g. the event name
+PRINT_RESIZE = getattr(user_config, "PRINT_RESIZE", "balanced")  # "fast", "balanced" or "best" - downscale to print width
+RASTER_DITHER = getattr(user_config, "RASTER_DITHER", "floyd-steinberg")  # floyd-steinberg, atkinson, bayer or threshold
+RASTER_BAND_BYTES = getattr(user_config, "RASTER_BAND_BYTES", 2048)  # Max bytes per raster band, keep under the printer buffer
+RASTER_SKIP_BLANK = getattr(user_config, "RASTER_SKIP_BLANK", True)  # Feed paper over blank rows and trim the right margin
+RASTER_TRIM_LEFT = getattr(user_config, "RASTER_TRIM_LEFT", False)  # Also trim the left margin (printer must support GS L in dots)
+PRINTER_BAUD_RATE = getattr(user_config, "PRINTER_BAUD_RATE", 9600)  # Or "auto" to detect the fastest rate the printer answers at
+PRINTER_FLOW_CONTROL = getattr(user_config, "PRINTER_FLOW_CONTROL", True)  # Pause writes while the printer holds DTR high
+PRINT_QUEUE_SIZE = getattr(user_config, "PRINT_QUEUE_SIZE", 3)  # Receipts that can wait to print (each holds a photo in memory)
+PRINT_QUEUE_FULL = getattr(user_config, "PRINT_QUEUE_FULL", "reject")  # "reject" new shots or "wait" for space when full
+FOCUS_MODE = getattr(user_config, "FOCUS_MODE", "continuous")  # "continuous" AF, or "on_press" for one AF cycle per shot
+FOCUS_STABLE_FRAMES = getattr(user_config, "FOCUS_STABLE_FRAMES", 3)  # Frames the lens must hold still to count as focused
+FOCUS_TIMEOUT = getattr(user_config, "FOCUS_TIMEOUT", 2.0)  # Seconds to wait for an on_press AF cycle
+CAMERA_PROFILE = getattr(user_config, "CAMERA_PROFILE", "preview")  # "preview" (sized streams) or "full" (full sensor all the time)
+CAMERA_MAIN_SIZE = getattr(user_config, "CAMERA_MAIN_SIZE", (2304, 1296))  # Covers the upload and print sizes, 2x2 binned sensor mode
+CAMERA_LORES_SIZE = getattr(user_config, "CAMERA_LORES_SIZE", (640, 360))  # Small stream for focus and metering
+CAMERA_FULL_RES_CAPTURE = getattr(user_config, "CAMERA_FULL_RES_CAPTURE", False)  # Switch to the full sensor just for the shot
+CAMERA_ROTATION = getattr(user_config, "CAMERA_ROTATION", 0)  # Degrees counter-clockwise, for a camera mounted sideways
+CAMERA_CROP = getattr(user_config, "CAMERA_CROP", None)  # Centred (width, height) in sensor pixels after rotation, cropped by the camera
+ZSL_FRAMES = getattr(user_config, "ZSL_FRAMES", 2)  # Recent frames to pick the sharpest from on a press, 0 to take the next frame
+REPRINT_CACHE_DIR = getattr(user_config, "REPRINT_CACHE_DIR", "reprints")  # Printed receipts kept for instant reprints, None to turn off
+REPRINT_CACHE_MB = getattr(user_config, "REPRINT_CACHE_MB", 20)  # Size cap, least recently printed receipts go first
+REPRINT_HOLD = getattr(user_config, "REPRINT_HOLD", 2.0)  # Seconds to hold the button to reprint instead of taking a shot, None to turn off
+REPRINT_COUNT = getattr(user_config, "REPRINT_COUNT", 1)  # Receipts reprinted by the hold gesture, most recent first
+TRACE_FILE = getattr(user_config, "TRACE_FILE", "traces.jsonl")  # Per-shot stage timings (JSONL), None to turn off
+SPOOL_ENABLED = getattr(user_config, "SPOOL_ENABLED", True)  # Keep shots on disk and retry when the network or API is down
+SPOOL_DIR = getattr(user_config, "SPOOL_DIR", "spool")
+SPOOL_RETRY_MIN = getattr(user_config, "SPOOL_RETRY_MIN", 15)    # Seconds before the first retry, doubles each time
+SPOOL_RETRY_MAX = getattr(user_config, "SPOOL_RETRY_MAX", 600)
+STARTUP_TIMEOUT = getattr(user_config, "STARTUP_TIMEOUT", 10)  # Max seconds to wait for focus, the printer and the API at startup
+
 # GPIO Pin Aliases
 PB_Red = 19
 PB_Green = 13
@@ -43,6 +109,8 @@ ROT_2_5 = 7
 ROT_2_6 = 16
 ROT_2_7 = 20
 ROT_2_8 = 21
+ROT_1_PINS = [ROT_1_1, ROT_1_2, ROT_1_3, ROT_1_4, ROT_1_5, ROT_1_6, ROT_1_7, ROT_1_8]
+ROT_2_PINS = [ROT_2_1, ROT_2_2, ROT_2_3, ROT_2_4, ROT_2_5, ROT_2_6, ROT_2_7, ROT_2_8]
 
 prompt_colors = {
     1: "WHITE",   # Standard poem
@@ -66,16 +134,10 @@ model_colors = {
 def printer_comms_test():
     try:
         # Clear buffers
-        printer.device.reset_input_buffer()
         printer.device.reset_output_buffer()
 
-        # Request printer status
-        printer._raw(b'\x10\x04\x01')  # DLE EOT 1 - Request printer status
-        time.sleep(0.2)  # Give printer time to respond
-
-        # Check for response
-        if printer.device.in_waiting > 0:
-            response = printer.device.read(printer.device.in_waiting)
+        # Request printer status (DLE EOT 1), done as soon as it answers
+        if request_status(printer.device.port, timeout=0.5) is not None:
             # print("Printer connected and responding!")
             return True
         else:
@@ -86,50 +148,111 @@ def printer_comms_test():
         print(f"ERROR: Printer test failed - {e}")
         return False
 
-def print_image():
+def print_photo(img, trace=None):
+    """Resize an image to the print head width and print it"""
+    receipt = Receipt(printer.profile)
+    compose_photo(receipt, img, trace)
+    receipt.send(printer)
+
+def compose_photo(receipt, img, trace=None):
+    """Add an image, resized to the print head width, to a receipt"""
+    from Stanza_Image import resize_for_print
+    import Stanza_Raster
+
+    if trace is None:
+        trace = Trace()
+    start = time.time()
+    source_size = img.size
+    with trace.span("print_resize"):
+        img = resize_for_print(img, 384, PRINT_RESIZE)
+    resize_ms = (time.time() - start) * 1000
+
+    if IMAGE_PRINT_MODE == "escpos":
+        # printer.image(img, center=True)  # Raster method, can cause stretching and weird buffer issues
+        receipt.doc.image(img, center=True, impl="bitImageColumn")  # Column method, fixes stretching and buffer issues but has lines along image width
+        print(f"Print image: {source_size[0]}x{source_size[1]} -> {img.width}x{img.height} "
+              f"({PRINT_RESIZE}) in {resize_ms:.0f} ms")
+    else:
+        # Own raster engine - dithered and packed with numpy, sent in bands small enough for the printer buffer
+        start = time.time()
+        with trace.span("raster_encode"):
+            bands = Stanza_Raster.encode_image(img, RASTER_DITHER, RASTER_BAND_BYTES,
+                                               compact=RASTER_SKIP_BLANK, trim_left=RASTER_TRIM_LEFT)
+        encode_ms = (time.time() - start) * 1000
+        print(f"Print image: {source_size[0]}x{source_size[1]} -> {img.width}x{img.height} "
+              f"({PRINT_RESIZE}) in {resize_ms:.0f} ms, raster encode {encode_ms:.0f} ms")
+        for band in bands:
+            receipt.raw(band)
+
+def print_image(capture):
     # Default (raster)
     # printer.image("lmao.PNG", center=True)
 
     # Column mode (may fix stretching)
     # printer.image("lmao.PNG", center=True, impl="bitImageColumn")
 
-    img = Image.open("test.jpg")
-    aspect_ratio = img.height / img.width
-    new_width = 384
-    new_height = int(new_width * aspect_ratio)
-    img = img.resize((new_width, new_height), Image.LANCZOS)
-
     printer.text("IMAGE NAME HERE\n")
-    # printer.image(img, center=True)  # Raster method, can cause stretching and weird buffer issues
-    printer.image(img, center=True, impl="bitImageColumn")  # Column method, fixes stretching and buffer issues but has lines along image width
+    print_photo(capture.image)
     printer.text("\n\n")
 
-def generate_poem_from_image(image_path, prompt_text, model):
-    """Send image to Claude API and get a poem back"""
+def generate_poem_from_image(capture, prompt_text, model, cancel_event=None, on_text=None, status=None,
+                             trace=None, on_abort=None):
+    """Send captured image to Claude API and get a poem back
+
+    If on_text is given the response is streamed and on_text is called with each
+    chunk of text as it arrives. If a status dict is given, failures fill in
+    "retryable" (worth trying again later) and "retry_after" (seconds, if the API said).
+    Timings go to trace (the capture's by default). on_abort is called with a function
+    that closes the response stream, for stopping it from another thread.
+    """
+    import anthropic  # Already loaded by the Claude connection, this just gets the error types
+
+    if status is None:
+        status = {}
+    if trace is None:
+        trace = capture.trace
+    status["retryable"] = False
+    status["retry_after"] = None
+
     if not ANTHROPIC_API_KEY or ANTHROPIC_API_KEY == "your-api-key-here":
         error_msg = "Invalid API key in config.py"
         print(f"ERROR: {error_msg}")
         return None, error_msg
 
     try:
-        # Read and encode image as base64
-        with open(image_path, "rb") as image_file:
-            image_data = base64.standard_b64encode(image_file.read()).decode("utf-8")
-
-        # Determine media type
-        if image_path.lower().endswith(".png"):
-            media_type = "image/png"
-        else:
-            media_type = "image/jpeg"
+        # Shrink the image to the upload budget
+        if capture.upload_jpeg is None:
+            from Stanza_Image import encode_for_upload
+            with trace.span("upload_encode"):
+                capture.upload_jpeg, (width, height), quality = encode_for_upload(
+                    capture.image, max_edge=UPLOAD_MAX_EDGE, max_bytes=UPLOAD_MAX_BYTES, quality=UPLOAD_JPEG_QUALITY)
+            print(f"Upload image: {width}x{height} q{quality}, {len(capture.upload_jpeg) // 1024} KB")
+        jpeg_bytes = capture.upload_jpeg
+
+        # Encode image as base64
+        image_data = base64.standard_b64encode(jpeg_bytes).decode("utf-8")
+        media_type = "image/jpeg"
+
+        # Don't spend an API call if the shot was discarded while we were encoding
+        if cancel_event and cancel_event.is_set():
+            return None, "Cancelled"
+
+        # setup() doesn't wait for a slow network, so the connection can still be starting
+        if claude is None:
+            error_msg = "Not connected to Claude yet"
+            print(f"ERROR: {error_msg}")
+            status["retryable"] = True
+            return None, error_msg
 
-        # Create Anthropic client
-        client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+        # Reuse the long-lived client, its connection is normally already open
+        client = claude.client
+        warm = claude.is_warm()
 
         # Send image to Claude with poem prompt
         print("Sending image to Claude for poem generation...")
         print(f"Using prompt: {prompt_text}")
         print(f"Using model: {model}")
-        message = client.messages.create(
+        request = dict(
             model=model,
             max_tokens=POEM_MAX_TOKENS,
             messages=[
@@ -152,6 +275,34 @@ def generate_poem_from_image(image_path, prompt_text, model):
                 }
             ],
         )
+        trace.set(model=model, warm_connection=warm)
+        request_start = time.time()
+        if on_text:
+            with client.messages.stream(**request) as stream:
+                # The stream opens once the response headers are back
+                trace.add("upload", time.time() - request_start)
+                if on_abort:
+                    on_abort(stream.close)
+                first_text = True
+                for text in stream.text_stream:
+                    if cancel_event and cancel_event.is_set():
+                        break  # Leaving the block closes the stream and stops generation
+                    if first_text:
+                        trace.add("ttft", time.time() - request_start)
+                        first_text = False
+                    on_text(text)
+                else:
+                    message = stream.get_final_message()
+        else:
+            message = client.messages.create(**request)
+        trace.add("generation", time.time() - request_start)
+        claude.mark_used()
+        print(f"API request: {(time.time() - request_start) * 1000:.0f} ms "
+              f"({'reused' if warm else 'new'} connection)")
+
+        if cancel_event and cancel_event.is_set():
+            print(f"Poem from {model} discarded")
+            return None, "Cancelled"
 
         # Extract poem text from response (with safety check)
         if message.content and hasattr(message.content[0], 'text'):
@@ -167,48 +318,230 @@ def generate_poem_from_image(image_path, prompt_text, model):
             return None, error_msg
 
     except anthropic.APIConnectionError:
+        if cancel_event and cancel_event.is_set():
+            return None, "Cancelled"  # Closed on purpose, e.g. a hedged request that lost
         error_msg = "No internet connection"
         print(f"ERROR: {error_msg}")
+        status["retryable"] = True
         return None, error_msg
     except anthropic.AuthenticationError:
         error_msg = "Invalid API key"
         print(f"ERROR: {error_msg}")
         return None, error_msg
-    except anthropic.RateLimitError:
+    except anthropic.RateLimitError as e:
         error_msg = "Rate limit exceeded"
         print(f"ERROR: {error_msg}")
+        status["retryable"] = True
+        status["retry_after"] = parse_retry_after(e.response)
         return None, error_msg
     except anthropic.APIStatusError as e:
         error_msg = f"API error {e.status_code}"
         print(f"ERROR: {error_msg}")
+        if e.status_code >= 500:  # Includes 529 overloaded
+            status["retryable"] = True
+            status["retry_after"] = parse_retry_after(e.response)
         return None, error_msg
     except Exception as e:
+        if cancel_event and cancel_event.is_set():
+            return None, "Cancelled"
         error_msg = f"Unknown error: {str(e)[:50]}"
         print(f"ERROR: {error_msg}")
         return None, error_msg
 
+def hedge_model_for(model):
+    """Backup model for hedged requests, None if model is already the fast one"""
+    backup = HEDGE_MODEL or next((name for name in CLAUDE_MODELS.values() if "haiku" in name), None)
+    return backup if backup != model else None
+
+def generate_poem_hedged(capture, prompt_text, model, cancel_event=None, on_text=None, status=None):
+    """generate_poem_from_image with a deadline, and a backup request if the first is slow to start
+
+    If no poem text has arrived from model within HEDGE_DELAY seconds (or it fails
+    outright), the same request goes to the backup model too. Whichever sends text
+    first is used and the other is closed, so streamed lines only ever come from one
+    model. POEM_DEADLINE caps the whole request. Running out before any text counts as
+    retryable, running out part way returns the text so far with status "truncated"
+    set. status also gets "model", the model whose answer was used.
+    """
+    if status is None:
+        status = {}
+    backup = hedge_model_for(model) if HEDGE_DELAY is not None else None
+    received = []  # Text passed on from the winner
+    text_lock = threading.Lock()
+
+    def call(attempt_model, attempt):
+        attempt.trace = Trace()
+        attempt.status = {}
+
+        def on_attempt_text(text):
+            # Only the first model to answer gets to print, and nothing once it's been cut off
+            with text_lock:
+                if attempt.claim() and not attempt.cancel_event.is_set():
+                    received.append(text)
+                    if on_text:
+                        on_text(text)
+
+        poem, error = generate_poem_from_image(
+            capture, prompt_text, attempt_model, cancel_event=attempt.cancel_event, on_text=on_attempt_text,
+            status=attempt.status, trace=attempt.trace, on_abort=attempt.on_abort)
+        if poem and not attempt.claim():
+            return None, "Cancelled"
+        return poem, error
+
+    race = HedgedRace(call, hedge_delay=HEDGE_DELAY, deadline=POEM_DEADLINE, cancel_event=cancel_event)
+    used = race.run(model, backup)
+    with text_lock:
+        pass  # Text already on its way to on_text has got there, nothing more follows
+
+    # Timings of the request that was used, plus the upload encode whichever request did it
+    for attempt in race.attempts:
+        if attempt is not used and "upload_encode" in attempt.trace.spans:
+            capture.trace.add("upload_encode", attempt.trace.spans["upload_encode"])
+    if used:
+        for name, seconds in used.trace.spans.items():
+            capture.trace.add(name, seconds)
+        capture.trace.set(**used.trace.fields)
+        if used is not race.attempts[0]:
+            capture.trace.add("hedge_wait", used.start - race.attempts[0].start)
+    if len(race.attempts) > 1:
+        capture.trace.set(hedged=True)
+        if used:
+            print(f"Hedged request: {used.arg} answered first")
+
+    if race.timed_out and used and received:
+        print(f"ERROR: Poem cut off at the {POEM_DEADLINE} s deadline")
+        capture.trace.set(truncated=True)
+        status["truncated"] = True
+        status["model"] = used.arg
+        return "".join(received), None
+    if race.timed_out:
+        error_msg = f"No answer within {POEM_DEADLINE} s"
+        print(f"ERROR: {error_msg}")
+        status["retryable"] = True
+        status["retry_after"] = None
+        return None, error_msg
+    if used is None:
+        return None, "Cancelled"
+    status.update(used.status)
+    status["model"] = used.arg  # The backup's poem is its own, not the selected model's
+    return used.result
+
+def parse_retry_after(response):
+    """Seconds from a retry-after header, or None"""
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def lookup_poem_cache(capture, prompt_text, model):
+    """Poem cached for a near-identical frame, returns (poem or None, the frame's hash or None)"""
+    if not poem_cache:
+        return None, None
+    from Stanza_Image import dhash
+
+    with capture.trace.span("poem_cache"):
+        image_hash = dhash(capture.image)
+        poem, distance = poem_cache.get(image_hash, prompt_text, model)
+    capture.trace.set(poem_cache="hit" if poem else "miss")
+    stats = poem_cache.stats()
+    result = f"hit ({distance} bits off)" if poem else "miss"
+    print(f"Poem cache {result} - {stats['hits']} hits, {stats['misses']} misses so far")
+    return poem, image_hash
+
+class PoemJob:
+    """Poem request running in a background thread so it can overlap other work
+
+    When streaming, finished printer lines are put on the lines queue as they
+    arrive, followed by None once the request is over.
+    """
+
+    def __init__(self, capture, prompt_text, model, stream=STREAM_POEM):
+        self.capture = capture
+        self.prompt_text = prompt_text
+        self.model = model
+        self.stream = stream
+        self.poem = None
+        self.error = None
+        self.status = {}
+        self.lines = queue.Queue()
+        self.done_event = threading.Event()
+        self.cancel_event = threading.Event()
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    @classmethod
+    def finished(cls, capture, prompt_text, model, poem, error=None):
+        """A job that already has its result, e.g. a poem generated for a spooled shot"""
+        job = cls(capture, prompt_text, model, stream=False)
+        job.poem = poem
+        job.error = error
+        job.lines.put(None)
+        job.done_event.set()
+        return job
+
+    def _worker(self):
+        assembler = PoemLineAssembler(FONT_COLUMNS[RECEIPT_FONT])
+
+        def on_text(text):
+            for line in assembler.feed(text):
+                self.lines.put(line)
+
+        # The race is only needed for hedging or a deadline
+        generate = generate_poem_hedged if HEDGE_DELAY is not None or POEM_DEADLINE else generate_poem_from_image
+        try:
+            cached, image_hash = lookup_poem_cache(self.capture, self.prompt_text, self.model)
+            if cached:
+                # Same scene, prompt and model as a recent shot - print its poem straight away
+                self.poem, self.error = cached, None
+                if self.stream:
+                    on_text(cached)
+            else:
+                self.poem, self.error = generate(
+                    self.capture, self.prompt_text, self.model, cancel_event=self.cancel_event,
+                    on_text=on_text if self.stream else None, status=self.status)
+                if self.status.get("truncated"):
+                    # Cut off by POEM_DEADLINE - the receipt ends with what arrived and a marker
+                    marker = "..." if self.poem.endswith("\n") else "\n..."
+                    self.poem += marker
+                    if self.stream:
+                        on_text(marker)
+                elif self.poem and image_hash is not None:
+                    # Under the model that wrote it, which for a hedged request can be the backup
+                    poem_cache.put(image_hash, self.prompt_text, self.status.get("model", self.model), self.poem)
+            if self.stream and self.poem:
+                for line in assembler.finish():
+                    self.lines.put(line)
+        finally:
+            self.lines.put(None)
+            self.done_event.set()
+
+    def result(self, timeout=None):
+        """Wait for the poem, returns (poem, error) like generate_poem_from_image"""
+        if not self.done_event.wait(timeout):
+            return None, "Timed out"
+        return self.poem, self.error
+
+    def cancel(self):
+        """Throw the result away, skips the API call entirely if it hasn't been sent yet"""
+        self.cancel_event.set()
+
+def select_prompt_and_model(rot_1_pos, rot_2_pos):
+    """Map rotary switch positions to a poem prompt and Claude model"""
+    selected_prompt = POEM_PROMPTS.get(rot_1_pos, POEM_PROMPTS[1])
+    selected_model = CLAUDE_MODELS.get(rot_2_pos, CLAUDE_MODELS[1])
+    return selected_prompt, selected_model
+
 def print_poem(poem_text):
     """Print poem text on thermal printer"""
     if not poem_text:
         return False
 
     try:
-        printer.text("\n")
-        printer.set(align='center')
-
-        # Print each line of the poem
-        for line in poem_text.strip().split('\n'):
-            # Wrap long lines to fit 32 char width
-            while len(line) > 32:
-                # Find last space before 32 chars
-                wrap_point = line[:32].rfind(' ')
-                if wrap_point == -1:
-                    wrap_point = 32
-                printer.text(line[:wrap_point] + "\n")
-                line = line[wrap_point:].strip()
-            printer.text(line + "\n")
-
-        printer.text("\n\n")  # Feed paper
+        # Whole poem, wrapped to the font's width, in one write
+        Receipt(printer.profile).text("\n").poem(poem_text, RECEIPT_FONT).text("\n\n").send(printer)
         print("Poem printed successfully!")
         return True
 
@@ -216,139 +549,338 @@ def print_poem(poem_text):
         print(f"ERROR: Failed to print poem - {e}")
         return False
 
-def print_image_with_poem(image_path, rot_1_pos, rot_2_pos):
-    """Print the captured image followed by a Claude-generated poem"""
-    # Print the image first
-    img = Image.open("test.jpg")
-    aspect_ratio = img.height / img.width
-    new_width = 384
-    new_height = int(new_width * aspect_ratio)
-    img = img.resize((new_width, new_height), Image.LANCZOS)
+def print_poem_stream(poem_job):
+    """Print poem lines as they come off the stream, returns the number of lines printed"""
+    printed = 0
+    try:
+        finished = False
+        while not finished:
+            # Everything that has arrived goes out in one write
+            lines = [poem_job.lines.get()]
+            while lines[-1] is not None:
+                try:
+                    lines.append(poem_job.lines.get_nowait())
+                except queue.Empty:
+                    break
+            if lines[-1] is None:
+                lines.pop()
+                finished = True
+
+            receipt = Receipt(printer.profile)
+            if lines and printed == 0:
+                receipt.text("\n")
+            if lines:
+                receipt.lines(lines, font=RECEIPT_FONT)
+                printed += len(lines)
+            if finished and printed:
+                receipt.text("\n\n")  # Feed paper
+            receipt.send(printer)
+
+        if printed:
+            print("Poem printed successfully!")
 
-    printer.text("\n")
-    printer.image(img, center=True, impl="bitImageColumn")
-    printer.text("\n")
+    except Exception as e:
+        print(f"ERROR: Failed to print poem - {e}")
+        poem_job.cancel()
+    return printed
 
-    # Get the selected prompt and model
-    selected_prompt = POEM_PROMPTS.get(rot_1_pos, POEM_PROMPTS[1])
-    selected_model = CLAUDE_MODELS.get(rot_2_pos, CLAUDE_MODELS[1])
+def spool_shot(poem_job):
+    """Keep a shot whose poem failed for a retry, returns True if it was spooled"""
+    if not (spool and poem_job.status.get("retryable")):
+        return False
+    capture = poem_job.capture
+    try:
+        if capture.upload_jpeg is None:
+            # The request never got as far as encoding it, e.g. POEM_DEADLINE ran out first
+            from Stanza_Image import encode_for_upload
+            capture.upload_jpeg, _, _ = encode_for_upload(
+                capture.image, max_edge=UPLOAD_MAX_EDGE, max_bytes=UPLOAD_MAX_BYTES, quality=UPLOAD_JPEG_QUALITY)
+        spool.add(capture.upload_jpeg, poem_job.prompt_text, poem_job.model,
+                  error=poem_job.error, retry_after=poem_job.status.get("retry_after"),
+                  archive_id=getattr(capture, "archive_id", None))
+        print(f"Shot spooled, will retry ({poem_job.error})")
+        return True
+    except Exception as e:
+        print(f"ERROR: Failed to spool shot - {e}")
+        return False
 
-    # Generate and print poem with selected prompt
-    poem, error = generate_poem_from_image("test.jpg", selected_prompt, selected_model)
-    if poem:
-        print_poem(poem)
-    else:
-        # Print the actual error message
-        printer.text("\nPoem generation failed\n")
-        if error:
-            # Wrap error message to fit printer width
-            error_lines = []
-            words = error.split()
-            current_line = ""
-            for word in words:
-                if len(current_line + word) <= 32:
-                    current_line += word + " "
-                else:
-                    error_lines.append(current_line.strip())
-                    current_line = word + " "
-            if current_line:
-                error_lines.append(current_line.strip())
-
-            for line in error_lines:
-                printer.text(line + "\n")
-        printer.text("\n\n")
-
-def is_focused():
-    """Check if camera is currently focused"""
-    # AfState values:
-    # 0 = Idle
-    # 1 = Scanning
-    # 2 = Focused
-    # 3 = Failed
-    metadata = picam2.capture_metadata()
-    af_state = metadata.get("AfState")
-    return af_state == 2  # 2 = Focused
-
-def take_image():
-    filename = f"capture_{time.strftime('%Y-%m-%d_%H-%M-%S')}.jpg"
-    # picam2.capture_file(filename)
-    picam2.capture_file("test.jpg")
-    print(f"Image captured: {filename}")
-
-def take_image_cropped_rotated():
-    filename = f"capture_{time.strftime('%Y-%m-%d_%H-%M-%S')}.jpg"
-    picam2.capture_file("temp.jpg")
-
-    # Open full resolution image
-    img = Image.open("temp.jpg")
-
-    # Rotate first (since camera is mounted sideways)
-    img = img.transpose(Image.Transpose.ROTATE_270)  # Or ROTATE_90 - try both
-
-    # Now image is portrait (2592x4608)
-    # Crop center to 1920x1080 landscape
-    width, height = img.size
-
-    # Calculate crop box for centered 1920x1080
-    left = (width - 1920) // 2
-    top = (height - 1080) // 2
-    right = left + 1920
-    bottom = top + 1080
-
-    img = img.crop((left, top, right, bottom))
-    img.save("test.jpg")
-    print(f"Image captured: {filename}")
-
-def camera_focus_loop():
-    global focus_count
-
-    if is_focused():
-        if focus_count < 10:  # Must achieve focus 10 times
-            focus_count += 1
-            # if focus_count == 10:
-            #     print("Focus achieved!")
-    else:
-        # if focus_count >= 10:
-        #     print("Lost focus!")
-        focus_count = 0
+def print_image_with_poem(capture, rot_1_pos, rot_2_pos, poem_job=None):
+    """Print the captured image followed by a Claude-generated poem
 
-    if focus_count >= 10:
-        focused = True
-        # pb_change_led("GREEN")
-    else:
-        focused = False
-        # pb_change_led("RED")
+    If a speculative poem_job was started at capture time its result is used
+    instead of sending a new request. Returns False if the poem couldn't be
+    printed (the shot may have gone to the spool instead).
+    """
+    printer.device.reset_stats()
 
-    return focused
+    # Start the poem request before printing so the network and serial link work at the same time
+    if poem_job is None:
+        poem_job = PoemJob(capture, *select_prompt_and_model(rot_1_pos, rot_2_pos)).start()
 
-def read_rotary_position(rotary_num):
-    pins = []
-    if rotary_num == 1:
-        pins = [ROT_1_1, ROT_1_2, ROT_1_3, ROT_1_4, ROT_1_5, ROT_1_6, ROT_1_7, ROT_1_8]
-    elif rotary_num == 2:
-        pins = [ROT_2_1, ROT_2_2, ROT_2_3, ROT_2_4, ROT_2_5, ROT_2_6, ROT_2_7, ROT_2_8]
+    # Known to be offline - find out if the poem fails before using any paper
+    if spool and claude and claude.online is False:
+        poem_job.result()
+        if not poem_job.poem and spool_shot(poem_job):
+            capture.trace.set(outcome="spooled")
+            return False
 
-    for i, pin in enumerate(pins, start=1):
-        if GPIO.input(pin) == GPIO.HIGH:
-            return i
+    # Print the image while the poem is generating - header and photo in one write
+    receipt = Receipt(printer.profile)
+    if RECEIPT_HEADER:
+        receipt.set(align="center", bold=True).text(RECEIPT_HEADER + "\n").set(bold=False)
+    receipt.text("\n")
+    compose_photo(receipt, capture.image, capture.trace)
+    receipt.text("\n")
+    poem_printed = False
+    if not poem_job.stream and poem_job.done_event.is_set() and poem_job.poem:
+        # Already have the poem (speculative or spooled) - the whole receipt is a single write
+        receipt.text("\n").poem(poem_job.poem, RECEIPT_FONT).text("\n\n")
+        poem_printed = True
+    receipt.send(printer)
+
+    # Wait for the poem (often already finished by the time the image is done)
+    if poem_job.stream:
+        # Lines that arrived during the image are printed straight away, the rest as they're generated
+        print_poem_stream(poem_job)
+        poem, error = poem_job.result()
+    else:
+        poem, error = poem_job.result()
+        if poem and not poem_printed:
+            print_poem(poem)
+
+    capture.trace.set(outcome="printed" if poem else "failed", poem_lines=len(poem.splitlines()) if poem else 0)
+    if not poem and spool_shot(poem_job):
+        capture.trace.set(outcome="spooled")
+        # The whole receipt prints again once the poem arrives
+        printer.text("\nNo connection - your poem will\nprint when we're back online\n\n\n")
+    elif not poem:
+        # Print the actual error message, wrapped to fit printer width
+        receipt = Receipt(printer.profile).text("\n").lines(["Poem generation failed"])
+        if error:
+            receipt.wrapped(error)
+        receipt.text("\n\n").send(printer)
 
-    return 0  # No position detected
+    stats = printer.device.report()
+    if stats:
+        capture.trace.add("serial", stats["seconds"])
+        capture.trace.set(serial_bytes=stats["bytes"])
+    return bool(poem)
 
-def read_pushbutton_state():
-    if GPIO.input(PB_NO) == GPIO.HIGH:
-        return 1
-    else:
+def print_worker():
+    """Print queued receipts in order, in the background so the camera stays free"""
+    while True:
+        job = print_queue.get()
+        if job[0] == "reprint":
+            try:
+                reprint_receipts(job[1])
+            finally:
+                print_queue.task_done()
+            continue
+
+        capture, rot_1_pos, rot_2_pos, poem_job, spool_job = job
+        capture.trace.end("queue_wait")
+        try:
+            with capture.trace.span("comms_test"):
+                printer_ok = printer_comms_test()
+            if printer_ok:
+                if reprints:
+                    printer.device.start_recording()
+                if print_image_with_poem(capture, rot_1_pos, rot_2_pos, poem_job):
+                    cache_receipt(capture)
+                if spool_job:
+                    spool.remove(spool_job)  # Only now is the spooled shot safely on paper
+                    spool_job = None
+            else:
+                capture.trace.set(outcome="printer offline")
+                poem_job.cancel()
+        except Exception as e:
+            capture.trace.set(outcome="failed", error=str(e)[:100])
+            print(f"ERROR: Print job failed - {e}")
+        finally:
+            printer.device.stop_recording()  # Nothing to keep if it failed part way
+            if spool_job:
+                spool_queued.discard(spool_job["id"])  # Still on disk, so the spool worker queues it again
+            finish_shot(capture, poem_job)
+            print_queue.task_done()
+
+def cache_receipt(capture):
+    """Keep the bytes of the receipt that just printed, so a reprint only has to send them again"""
+    data = printer.device.stop_recording()
+    if not data:
+        return
+    try:
+        reprints.add(f"{capture.timestamp:.3f}".replace(".", "_"), data)
+    except OSError as e:
+        print(f"ERROR: Failed to cache receipt for reprints - {e}")
+
+def queue_reprint(count):
+    """Queue the last count receipts to print again, returns the number of receipts now waiting or printing"""
+    receipt_ids = reprints.latest(count) if reprints else []
+    if not receipt_ids:
+        print("Nothing to reprint")
         return 0
+    try:
+        print_queue.put_nowait(("reprint", list(reversed(receipt_ids))))  # Oldest first, like they were printed
+    except queue.Full:
+        print("Print queue full, reprint rejected")
+        return 0
+    depth = print_queue.unfinished_tasks
+    print(f"Reprint queued ({len(receipt_ids)} receipts, {depth} in queue)")
+    return depth
 
-def wait_for_pushbutton_press(timeout=3.0):
-    start_time = time.time()
-
-    while time.time() - start_time < timeout:
-        if read_pushbutton_state() == 1:
-            return True  # Button was pressed
-        time.sleep(0.01)  # Check every 10ms
+def reprint_receipts(receipt_ids):
+    """Send cached receipts straight to the printer - no camera, image or API work"""
+    printer.device.reset_stats()
+    try:
+        for receipt_id in receipt_ids:
+            data = reprints.get(receipt_id)
+            if data is None:
+                print(f"ERROR: Receipt {receipt_id} is no longer cached")
+                continue
+            printer._raw(data)
+            print(f"Reprinted receipt {receipt_id} ({len(data)} bytes)")
+        printer.device.report()
+    except Exception as e:
+        print(f"ERROR: Reprint failed - {e}")
+
+def finish_shot(capture, poem_job=None):
+    """Log a finished shot's stage timings, and its poem and print status if it's archived"""
+    if trace_log:
+        trace_log.write(capture.trace)
+    archive_id = getattr(capture, "archive_id", None)
+    if archive and archive_id:
+        record = capture.trace.record()
+        poem, error = (poem_job.poem, poem_job.error) if poem_job and poem_job.done_event.is_set() else (None, None)
+        archive.update(archive_id, poem=poem, error=error, print_status=record.get("outcome"),
+                       total_ms=record["total"], timings=record["spans"])
+
+def spool_worker():
+    """Retry spooled shots in the background and queue their receipts once the poem comes back"""
+    from Stanza_Camera import Capture
+
+    # Spooled receipts leave the last slot in the print queue for a live shot
+    spool_slots = max(1, PRINT_QUEUE_SIZE - 1)
+    while True:
+        delay = 2.0
+        for job in spool.jobs():
+            if job["id"] in spool_queued:
+                continue
+            if print_queue.qsize() >= spool_slots:
+                break  # Nothing more until the printer catches up
+
+            if not job.get("done"):
+                # Wait for the keep-alive to see the API again, and for the job's backoff
+                if (claude and claude.online is False) or time.time() < job["next_try"]:
+                    continue
+                print(f"Retrying spooled shot {job['id']} (attempt {job['attempts'] + 1})")
+                capture = Capture.from_upload_jpeg(spool.load_image(job), job["created"])
+                capture.archive_id = job.get("archive_id")
+                capture.trace.set(source="spool", attempt=job["attempts"] + 1)
+                status = {}
+                poem, error = generate_poem_from_image(capture, job["prompt"], job["model"], status=status)
+                if not poem and status["retryable"]:
+                    spool.retry_later(job, error, status["retry_after"])
+                    delay = max(delay, job["next_try"] - time.time())
+                    break  # Still down - don't burn through the rest of the spool
+                # Keep the result on disk so a crash before printing doesn't cost another API call
+                job["done"] = True
+                job["poem"] = poem
+                job["last_error"] = error
+                spool.update(job)
+            else:
+                capture = Capture.from_upload_jpeg(spool.load_image(job), job["created"])
+                capture.archive_id = job.get("archive_id")
+                capture.trace.set(source="spool")
+
+            # Finished (or failed for good, which prints the error) - send it to the printer
+            poem_job = PoemJob.finished(capture, job["prompt"], job["model"], job["poem"],
+                                        None if job["poem"] else job["last_error"])
+            capture.trace.begin("queue_wait")
+            spool_queued.add(job["id"])
+            try:
+                print_queue.put_nowait((capture, None, None, poem_job, job))
+            except queue.Full:
+                spool_queued.discard(job["id"])  # A live shot got the slot first, try again next time
+                break
+
+        time.sleep(min(delay, 30.0))
+
+def queue_print(capture, rot_1_pos, rot_2_pos, poem_job=None):
+    """Hand a confirmed shot to the print worker, returns the number of receipts now waiting or printing
+
+    Returns 0 if the queue is full and PRINT_QUEUE_FULL is "reject" (the shot is thrown away).
+    """
+    # The user has confirmed, so get the poem going now rather than when the printer gets to it
+    if poem_job is None:
+        poem_job = PoemJob(capture, *select_prompt_and_model(rot_1_pos, rot_2_pos)).start()
+
+    capture.trace.begin("queue_wait")
+    job = (capture, rot_1_pos, rot_2_pos, poem_job, None)
+    try:
+        print_queue.put_nowait(job)
+    except queue.Full:
+        # Filled up since the press, e.g. by a spooled receipt or a reprint
+        if PRINT_QUEUE_FULL == "reject":
+            print("Print queue full, shot rejected")
+            poem_job.cancel()
+            capture.trace.set(outcome="rejected")
+            finish_shot(capture, poem_job)
+            return 0
+        # Block until the printer frees a slot
+        print("Print queue full, waiting...")
+        pb_flash_threaded_start("YELLOW", delay=0.25)
+        print_queue.put(job)
+        pb_flash_threaded_stop()
+
+    depth = print_queue.unfinished_tasks
+    print(f"Receipt queued ({depth} in queue)")
+    return depth
+
+def archive_shot(capture, rot_1_pos, rot_2_pos):
+    """Queue the shot for the archive if its model position saves to file (the writes happen in the background)"""
+    if not archive or not (ARCHIVE_CAPTURES or rot_2_pos in ARCHIVE_MODEL_POSITIONS):
+        return None
+    prompt_text, model = select_prompt_and_model(rot_1_pos, rot_2_pos)
+    shot_id = archive.add(capture, style=rot_1_pos, model_position=rot_2_pos, prompt=prompt_text, model=model)
+    if shot_id:
+        print(f"Image archived: {shot_id}")
+    return shot_id
+
+def take_image(trace=None):
+    # Capture straight into memory, the frame is shared by the print and upload stages
+    from Stanza_Camera import Capture, process_memory_mb
+
+    if trace is None:
+        trace = Trace()
+    capture_start = time.time()
+    capture = None
+    if CAMERA_FULL_RES_CAPTURE and CAMERA_PROFILE != "full":
+        capture = Capture.from_camera_mode(picam2, still_config)
+        print(f"Full resolution switch took {capture.switch_time * 1000:.0f} ms "
+              f"(process {process_memory_mb() or 0:.0f} MB)")
+    elif frame_ring:
+        # Zero shutter lag - the sharpest of the frames from just before the press
+        start = time.time()
+        capture = frame_ring.best_capture()
+        if capture:
+            scores = ", ".join(f"{score:.0f}" for score in capture.sharpness_scores)
+            print(f"Picked frame {capture.sharpness_index + 1} of {len(capture.sharpness_scores)} "
+                  f"(sharpness {scores}) in {(time.time() - start) * 1000:.0f} ms")
+    if capture is None:
+        capture = Capture.from_camera(picam2)
+    if roi["rotate"]:
+        # The camera has already cropped, so this only turns the small frame
+        capture.rotate(roi["rotate"])
+    trace.add("capture", time.time() - capture_start)
+    trace.set(source="camera", size=list(capture.image.size))
+    capture.trace = trace
+    print(f"Image captured: {capture.filename} ({capture.image.width}x{capture.image.height})")
+    return capture
 
-    return False  # Timeout - button not pressed
+def wait_for_pushbutton_press(timeout=3.0):
+    # Only count presses from now on, not ones made while the LED was flashing
+    inputs.clear()
+    return inputs.wait_for_press(timeout)  # False on timeout - button not pressed
 
 def pb_change_led(color):
     if color == "RED":
@@ -433,8 +965,201 @@ def pb_is_flashing():
     return flash_thread and flash_thread.is_alive()
 
 
-try:
+GPIO = None
+picam2 = None
+printer = None
+claude = None
+frame_ring = None
+trace_log = None
+spool = None
+spool_queued = set()  # Ids of spooled shots waiting in the print queue
+archive = None
+reprints = None
+poem_cache = None
+flash_thread = None
+flash_stop_event = threading.Event()
+startup_times = {}  # Seconds taken by each part of the startup
+
+
+def start_camera(camera, deadline):
+    """Configure and start the camera, returns once frames are coming in (and focused in continuous mode)"""
+    global picam2, roi, still_config, focus, frame_ring
+    # First import of numpy and PIL, while the printer and network threads import theirs
+    from Stanza_Camera import FocusTracker, FrameRing, camera_roi, fit_size, camera_buffer_bytes, process_memory_mb
+
+    # Camera Setup
+    if camera is None:
+        from picamera2 import Picamera2
+        camera = Picamera2()
+    try:
+        from libcamera import Transform
+    except ImportError:
+        Transform = camera.Transform  # No libcamera, so a stand-in camera that brings its own (Stanza_Fakes)
+    picam2 = camera
+
+    # Crop and flip in the camera pipeline, so frames come out at the crop size instead of
+    # being cut out of a full resolution frame afterwards
+    roi = camera_roi(picam2.camera_properties["PixelArraySize"], CAMERA_CROP, CAMERA_ROTATION)
+    transform = Transform(hflip=roi["hflip"], vflip=roi["vflip"])
+    roi_controls = {"ScalerCrop": roi["scaler_crop"]} if roi["scaler_crop"] else {}
+    if roi["scaler_crop"]:
+        print(f"Camera crop: {roi['size'][0]}x{roi['size'][1]} at ({roi['scaler_crop'][0]}, {roi['scaler_crop'][1]})"
+              f", rotated {CAMERA_ROTATION} degrees")
+
+    still_config = picam2.create_still_configuration(  # Full sensor resolution, or the crop of it
+        main={"size": roi["size"]} if roi["size"] else {},
+        transform=transform,
+        controls=roi_controls,
+    )
+    # Zero shutter lag needs frames from before the press, which on_press focus and the
+    # full resolution switch never use (and the full profile has no buffers to spare)
+    zsl_frames = ZSL_FRAMES if (CAMERA_PROFILE != "full" and FOCUS_MODE != "on_press" and
+                                not CAMERA_FULL_RES_CAPTURE) else 0
+    if CAMERA_PROFILE == "full":
+        config = still_config
+    else:
+        # Main stream only as big as the printer and upload need, small lores stream for focus and metering
+        config = picam2.create_preview_configuration(
+            main={"size": roi["size"] or CAMERA_MAIN_SIZE, "format": "RGB888"},
+            lores={"size": fit_size(roi["size"], CAMERA_LORES_SIZE) if roi["size"] else CAMERA_LORES_SIZE},
+            # Frames held by the ring can't be refilled, the camera needs two more to keep running
+            buffer_count=zsl_frames + 2 if zsl_frames else 3,
+            transform=transform,
+            controls=roi_controls,
+        )
+    picam2.configure(config)
+    buffers = camera_buffer_bytes(picam2.camera_config)
+    print("Camera buffers: " + ", ".join(f"{stream} {size / 1e6:.1f} MB" for stream, size in buffers.items()) +
+          f" (process {process_memory_mb() or 0:.0f} MB)")
+    picam2.set_controls({
+        "AfMode": 1 if FOCUS_MODE == "on_press" else 2,  # Auto (one cycle per trigger) or Continuous
+        "AfSpeed": 1  # Fast
+    })
+
+    # Focus changes arrive as events alongside the button and rotary switches
+    focus = FocusTracker(picam2, stable_frames=FOCUS_STABLE_FRAMES,
+                         on_change=lambda focused: inputs.events.put(("focus", 0, int(focused))))
+
+    # Ring of recent frames for zero shutter lag
+    if zsl_frames:
+        frame_ring = FrameRing(zsl_frames, score_stream="lores")
+
+    def on_camera_frame(request):
+        focus.on_frame(request)
+        if frame_ring:
+            frame_ring.add(request)
+
+    picam2.post_callback = on_camera_frame
+
+    picam2.start()
+    start = time.time()
+
+    # Ready once frames arrive and (in continuous mode) the lens settles, instead of a fixed wait
+    if focus.first_frame_event.wait(max(0.0, deadline - time.time())):
+        startup_times["first frame"] = time.time() - start
+    else:
+        print("ERROR: No frames from the camera yet")
+        return
+    if FOCUS_MODE == "continuous":
+        if focus.wait_focused(max(0.0, deadline - time.time())):
+            startup_times["focused"] = time.time() - start
+        else:
+            print("Camera not focused yet, carrying on")
+
+def start_printer(printer_port, deadline):
+    """Open and reset the printer, returns once it answers a status request"""
+    global printer
+    from escpos.printer import Serial  # escpos is slow to import, so it's loaded here alongside the camera and network
+
+    printer = Serial(devfile='/dev/serial0', baudrate=9600 if PRINTER_BAUD_RATE == "auto" else PRINTER_BAUD_RATE, timeout=1)
+    if printer_port is not None:
+        printer.device = printer_port  # Set before first use, so escpos never opens the real port
+    printer.profile.profile_data['media']['width']['pixels'] = 384
+    printer.profile.profile_data['media']['width']['mm'] = 48  # Effective, Actual is 57.5mm
+    # Clear any junk from serial buffers
+    printer.device.reset_input_buffer()
+    printer.device.reset_output_buffer()
+
+    # Find the rate first, anything sent before then reaches the printer as noise
+    if PRINTER_BAUD_RATE == "auto":
+        baud_rate = detect_baud_rate(printer.device)
+        if baud_rate:
+            print(f"Printer baud rate: {baud_rate}")
+        else:
+            print("ERROR: Could not detect printer baud rate, using 9600")
+
+    printer._raw(b'\x1B\x40')  # ESC @ - Initialize printer (clears buffer, including any noise from the detection)
+    # printer.set(density=4)
+
+    # Ready as soon as the printer answers after its reset, rather than after a fixed wait
+    reply = None
+    while reply is None and time.time() < deadline:
+        reply = request_status(printer.device, timeout=0.25)
+    if reply is None:
+        print("ERROR: No response from printer!")
+
+    # Route all printer writes through the transport for chunking, flow control and stats
+    printer.device = SerialTransport(printer.device, gpio=GPIO if PRINTER_FLOW_CONTROL else None, busy_pin=DTR)
+    if PRINTER_FLOW_CONTROL:
+        printer._raw(ENABLE_DTR)
+
+def start_claude(api_base_url):
+    """Connect to the Claude API, returns once the first connection is open (or has failed)"""
+    global claude
+    # One client for the whole session, the anthropic import happens in here
+    claude = ClaudeConnection(ANTHROPIC_API_KEY, keepalive_interval=CLAUDE_KEEPALIVE_INTERVAL,
+                              base_url=api_base_url)
+    claude.warm_up()
+    claude.start_keepalive()
+
+def start_in_thread(name, target, *args):
+    """Run one part of the startup in its own thread, timed into startup_times"""
+    def run_part():
+        start = time.time()
+        try:
+            target(*args)
+        except BaseException as e:  # Raised again by setup in the main thread
+            thread.error = e
+        startup_times[name] = time.time() - start
+
+    thread = threading.Thread(target=run_part, daemon=True)
+    thread.error = None
+    thread.start()
+    return thread
+
+def log_startup_times(total):
+    """One line breakdown of where the startup time went"""
+    parts = []
+    for name in ("imports", "gpio", "camera", "printer", "Claude API"):
+        if name not in startup_times:
+            continue
+        part = f"{name} {startup_times[name]:.1f} s"
+        if name == "camera":
+            details = [f"{detail} {startup_times[detail]:.1f} s" for detail in ("first frame", "focused")
+                       if detail in startup_times]
+            if details:
+                part += " (" + ", ".join(details) + ")"
+        parts.append(part)
+    print(f"Startup {total:.1f} s: " + ", ".join(parts))
+
+
+def setup(gpio=None, camera=None, printer_port=None, api_base_url=None):
+    """Bring up the GPIO, camera, printer and API connection, and start the background workers
+
+    Uses the real hardware by default. gpio (RPi.GPIO-like), camera (Picamera2-like)
+    and printer_port (pyserial-like) replace it, e.g. with the fakes in Stanza_Fakes,
+    and api_base_url points the Claude client at another server.
+    """
+    global GPIO, inputs, trace_log, print_queue, spool, archive, reprints, poem_cache
+
     print("----- StanzaCam V1.2 -----")
+    setup_start = time.time()
+    startup_times["imports"] = setup_start - startup_start
+
+    # Real hardware unless fakes are passed in (see Stanza_Fakes)
+    if gpio is None:
+        import RPi.GPIO as gpio
+    GPIO = gpio
 
     # Setup GPIO
     GPIO.setmode(GPIO.BCM)
@@ -458,6 +1183,11 @@ try:
     GPIO.setup(ROT_2_6, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
     GPIO.setup(ROT_2_7, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
     GPIO.setup(ROT_2_8, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+    if PRINTER_FLOW_CONTROL:
+        GPIO.setup(DTR, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+
+    # Button and rotary switches report changes through edge callbacks instead of being polled
+    inputs = InputEvents(GPIO, PB_NO, {1: ROT_1_PINS, 2: ROT_2_PINS})
 
     # Start all OFF
     GPIO.output(PB_Red, GPIO.HIGH)
@@ -471,109 +1201,214 @@ try:
     # Start PB LED magenta to indicate starting up
     pb_change_led("MAGENTA")
 
-    # Camera Setup
-    picam2 = Picamera2()
-    config = picam2.create_still_configuration()
-    picam2.configure(config)
-    picam2.set_controls({
-        "AfMode": 2,  # Continuous
-        "AfSpeed": 1  # Fast
-    })
-
-    picam2.start()
-    time.sleep(3)
-
-    # Printer Setup
-    printer = Serial(devfile='/dev/serial0', baudrate=9600, timeout=1)
-    printer.profile.profile_data['media']['width']['pixels'] = 384
-    printer.profile.profile_data['media']['width']['mm'] = 48  # Effective, Actual is 57.5mm
-    printer._raw(b'\x1B\x40')  # ESC @ - Initialize printer (clears buffer)
-    # printer.set(density=4)
-    time.sleep(0.5)
-    # Clear any junk from serial buffers
-    printer.device.reset_input_buffer()
-    printer.device.reset_output_buffer()
-    time.sleep(0.5)
-
+    gpio_done = time.time()
+    startup_times["gpio"] = gpio_done - setup_start
+
+    # Camera, printer and API connection come up at the same time, each done when it's
+    # actually ready (frames and focus, a printer status reply, an open connection)
+    deadline = gpio_done + STARTUP_TIMEOUT
+    starting = [start_in_thread("camera", start_camera, camera, deadline),
+                start_in_thread("printer", start_printer, printer_port, deadline)]
+    claude_thread = None
+    if ANTHROPIC_API_KEY and ANTHROPIC_API_KEY != "your-api-key-here":
+        claude_thread = start_in_thread("Claude API", start_claude, api_base_url)
+    for thread in starting:
+        thread.join()
+        if thread.error:
+            raise thread.error
+    if claude_thread:
+        # No need to hold up the camera for the network - an offline booth spools its shots
+        claude_thread.join(max(0.0, deadline - time.time()))
+        if claude_thread.is_alive():
+            print("Claude API still connecting, carrying on")
+        elif claude_thread.error:
+            raise claude_thread.error
+
+    # One line of stage timings per shot, summarised with: python3 Stanza_Trace.py report
+    if TRACE_FILE:
+        trace_log = TraceLog(TRACE_FILE)
+
+    # Archived shots are written by a background thread, browse or export them with Stanza_Archive.py
+    if ARCHIVE_CAPTURES or ARCHIVE_MODEL_POSITIONS:
+        try:
+            archive = Archive(ARCHIVE_DIR)
+        except (OSError, sqlite3.Error) as e:
+            print(f"ERROR: Archive unavailable, shots won't be saved - {e}")
+
+    # Poems for near-identical frames are reused instead of asking Claude again
+    if POEM_CACHE:
+        from Stanza_PoemCache import PoemCache
+        poem_cache = PoemCache(POEM_CACHE_FILE, max_entries=POEM_CACHE_SIZE, ttl=POEM_CACHE_TTL,
+                               max_distance=POEM_CACHE_DISTANCE)
+
+    # Every printed receipt is kept as its final bytes, for reprints by holding the button
+    if REPRINT_CACHE_DIR:
+        try:
+            reprints = ReceiptCache(REPRINT_CACHE_DIR, max_bytes=REPRINT_CACHE_MB * 1024 * 1024)
+        except OSError as e:
+            print(f"ERROR: Reprint cache unavailable - {e}")
+
+    # Receipts print in the background so the next photo can be taken straight away
+    print_queue = queue.Queue(maxsize=PRINT_QUEUE_SIZE)
+    threading.Thread(target=print_worker, daemon=True).start()
+
+    # Shots left in the spool (including from before a restart) are retried in the background
+    if SPOOL_ENABLED:
+        spool = Spool(SPOOL_DIR, retry_min=SPOOL_RETRY_MIN, retry_max=SPOOL_RETRY_MAX)
+        threading.Thread(target=spool_worker, daemon=True).start()
+
+    log_startup_times(time.time() - startup_start)
+
+
+def run():
+    """The main loop - button, switches and LED until interrupted"""
     # -------------------- MAIN --------------------
 
     print("Running...")
 
     rot_1_old = 0
     rot_2_old = 0
-    pb_state_old = 0
-    focus_count = 0
     focused = False
     focused_old = False
-    flash_thread = None
-    flash_stop_event = threading.Event()
+    queue_full_old = False
+    flash_col_old = None
 
     while True:
         # Stuff here will run continuously
 
-        # Get latest state of switches
-        rot_1 = read_rotary_position(1)
-        rot_2 = read_rotary_position(2)
-        pb_state = read_pushbutton_state()
+        # Sleep until something happens - input, focus change, or a periodic look at the print queue
+        event = inputs.get(timeout=0.25)
+        pressed = event == ("button", 1, 1)
+        if event == ("focus", 0, 1) and focus.time_to_focus is not None:
+            print(f"Focus acquired in {focus.time_to_focus * 1000:.0f} ms")
 
-        # Debounce rotary switches - re-read if either is 0
-        while rot_1 == 0 or rot_2 == 0:
-            time.sleep(0.02)  # 20ms of debounce then re-read states
-            rot_1 = read_rotary_position(1)
-            rot_2 = read_rotary_position(2)
+        # Latest debounced state of switches (positions between detents are already filtered out)
+        rot_1 = inputs.rotary[1]
+        rot_2 = inputs.rotary[2]
+
+        # A switch left between detents since startup has no position yet - nothing works until it has one
+        if rot_1 == 0 or rot_2 == 0:
+            continue
 
         if rot_2 != rot_2_old:
             pb_flash_blocking(model_colors.get(rot_2, "OFF"), num=3, delay=0.1)
 
-        focused = camera_focus_loop()
-        if not focused:
-            if not pb_is_flashing():
-                pb_flash_threaded_start("RED")
+        # In on_press mode focus is only checked when the button is pressed
+        focused = focus.is_focused() if FOCUS_MODE != "on_press" else True
+        queue_full = print_queue.full()
+        if not focused or queue_full:
+            # Red - not focused, yellow - print queue is full
+            flash_col = "RED" if not focused else "YELLOW"
+            if not pb_is_flashing() or flash_col != flash_col_old:
+                pb_flash_threaded_start(flash_col)
+            flash_col_old = flash_col
         else:
             if pb_is_flashing():
                 pb_flash_threaded_stop()
+            flash_col_old = None
 
             # If either rotary is switched or focus has just been achieved, set led to prompt color
-            if rot_1 != rot_1_old or rot_2 != rot_2_old or focused != focused_old:
+            if rot_1 != rot_1_old or rot_2 != rot_2_old or focused != focused_old or queue_full != queue_full_old:
                 pb_change_led(prompt_colors.get(rot_1, "WHITE"))
 
 
         # Check pushbutton AFTER updating everything else (e.g. focus)
-        if pb_state != pb_state_old:
+        if pressed:
             # Stuff here will only run once on pushbutton press
 
-            time.sleep(0.02)  # 20ms of debounce then re-read pushbutton state
-            pb_state = read_pushbutton_state()
+            if queue_full and PRINT_QUEUE_FULL == "reject":
+                # No room for another receipt, don't spend a shot (or an API call) on it
+                print("Print queue full, shot rejected")
+                pb_flash_threaded_stop()
+                pb_flash_blocking("RED", num=3, delay=0.1)
 
             # Taking image when properly focused
-            if focused and pb_state == 1:
+            elif focused:
                 print("\nTaking image...")
                 pb_change_led("OFF")
-                take_image()
+                trace = Trace(style=rot_1)
+
+                if FOCUS_MODE == "on_press":
+                    # Run one AF cycle now, instead of keeping the lens hunting all the time
+                    pb_flash_threaded_start("RED", delay=0.1)
+                    focus.trigger()
+                    with trace.span("focus"):
+                        af_ok = focus.wait_focused(FOCUS_TIMEOUT)
+                    pb_flash_threaded_stop()
+                    if af_ok:
+                        print(f"Focus acquired in {focus.time_to_focus * 1000:.0f} ms")
+                    else:
+                        print("Focus not confirmed, taking image anyway")
+                elif focus.time_to_focus is not None:
+                    trace.add("focus", focus.time_to_focus)  # How long focus took to settle before the press
+
+                capture = take_image(trace)
+
+                # Speculative mode - get the poem started while the user decides whether to print
+                poem_job = None
+                if SPECULATIVE_POEM:
+                    poem_job = PoemJob(capture, *select_prompt_and_model(rot_1, rot_2)).start()
+
                 pb_flash_blocking("BLUE", num=5, delay=0.1)
-                pb_flash_threaded_start("WHITE", delay=0.25)
-                print_requested = wait_for_pushbutton_press()
-                pb_flash_threaded_stop()
-                if print_requested:
-                    if printer_comms_test():
-                        pb_flash_threaded_start("CYAN", delay=0.5)
+
+                # Still holding the button - they want another copy of the last receipt, not this shot
+                # (the shot is taken on the press anyway, so normal shots never wait for the release)
+                if reprints and REPRINT_HOLD and inputs.held_for(REPRINT_HOLD, trace.start):
+                    if poem_job:
+                        poem_job.cancel()
+                    depth = queue_reprint(REPRINT_COUNT)
+                    if depth:
+                        pb_flash_blocking("CYAN", num=depth, delay=0.1)
+                    else:
+                        pb_flash_blocking("RED", num=3, delay=0.1)
+                else:
+                    archive_shot(capture, rot_1, rot_2)
+                    pb_flash_threaded_start("WHITE", delay=0.25)
+                    with trace.span("confirm"):
+                        print_requested = wait_for_pushbutton_press()
+                    pb_flash_threaded_stop()
+                    if print_requested:
                         # print(f"Selected poem style: Position {rot_1}")
-                        print_image_with_poem("test.jpg", rot_1, rot_2)
-                        pb_flash_threaded_stop()
+                        depth = queue_print(capture, rot_1, rot_2, poem_job)
+                        if depth:
+                            pb_flash_blocking("CYAN", num=depth, delay=0.1)  # One flash per receipt in the queue
+                        else:
+                            pb_flash_blocking("RED", num=3, delay=0.1)
+                    else:
+                        if poem_job:
+                            # Not printing - discard the speculative poem
+                            poem_job.cancel()
+                        trace.set(outcome="not printed")
+                        finish_shot(capture, poem_job)
+                focus.reset()
                 focused = False
-                focus_count = 0
 
         # Store old states for comparison next loop
         rot_1_old = rot_1
         rot_2_old = rot_2
-        pb_state_old = pb_state
         focused_old = focused
+        queue_full_old = queue_full
 
-        # Run 50 times a second
-        time.sleep(0.02)
 
-except KeyboardInterrupt:
+def shutdown():
     print("\n\n\nStopping...")
-    GPIO.cleanup()
+    if claude:
+        claude.stop_keepalive()
+    if archive and not archive.flush(timeout=5.0):
+        print("ERROR: Archive writer didn't finish, the last shots may be missing")
+    if GPIO:
+        GPIO.cleanup()
+
+
+def main():
+    try:
+        setup()
+        run()
+    except KeyboardInterrupt:
+        shutdown()
+
+
+if __name__ == "__main__":
+    main()
 
 # ALT+A, ALT+/, CTRL+K quick delete nano file
\ No newline at end of file
@@ -0,0 +1,101 @@
+# StanzaCam - Poem cache
+#
+# Setup, rehearsals and static demos send near-identical frames with the same prompt
+# and model again and again. Poems are cached against a perceptual hash of the frame
+# (Stanza_Image.dhash) plus the prompt and model, and a new frame within max_distance
+# bits of a cached one reuses its poem instead of making an API call. Entries expire
+# after ttl seconds, the least recently used go first once it's full, and the cache
+# is kept in a JSON file so it survives restarts.
+
+import collections
+import json
+import os
+import threading
+import time
+from Stanza_Image import hamming
+
+
+class PoemCache:
+    """Poems for recent frames, looked up by how similar the frame looks"""
+
+    def __init__(self, path, max_entries=200, ttl=3600, max_distance=6):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()  # One writer of the file at a time
+        self.entries = collections.OrderedDict()  # (hash, prompt, model) -> (poem, created), least recently used first
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                for image_hash, prompt_text, model, poem, created in json.load(f):
+                    self.entries[(image_hash, prompt_text, model)] = (poem, created)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, TypeError) as e:
+            print(f"ERROR: Poem cache unreadable, starting empty - {e}")
+            self.entries.clear()
+        self._expire(time.time())
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        with self.save_lock:
+            # Snapshot inside the save lock, so an older snapshot can't be written over a newer one
+            with self.lock:
+                data = [[*key, poem, created] for key, (poem, created) in self.entries.items()]
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"ERROR: Failed to save poem cache - {e}")
+
+    def _expire(self, now):
+        # Caller holds the lock (or is _load)
+        if self.ttl is None:
+            return
+        for key in [key for key, (_, created) in self.entries.items() if now - created > self.ttl]:
+            del self.entries[key]
+
+    def get(self, image_hash, prompt_text, model):
+        """(poem, distance in bits) for the closest cached frame with the same prompt and model
+
+        Returns (None, None) if nothing is close enough. Counts as a hit or a miss.
+        """
+        with self.lock:
+            self._expire(time.time())
+            best_key, best_distance = None, None
+            for key in self.entries:
+                if key[1] != prompt_text or key[2] != model:
+                    continue
+                distance = hamming(key[0], image_hash)
+                if distance <= self.max_distance and (best_distance is None or distance < best_distance):
+                    best_key, best_distance = key, distance
+            if best_key is None:
+                self.misses += 1
+                return None, None
+            self.hits += 1
+            self.entries.move_to_end(best_key)
+            return self.entries[best_key][0], best_distance
+
+    def put(self, image_hash, prompt_text, model, poem):
+        """Keep a freshly generated poem"""
+        key = (image_hash, prompt_text, model)
+        with self.lock:
+            self.entries[key] = (poem, time.time())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        self._save()
+
+    def stats(self):
+        """Hit and miss counts since startup, to judge whether the cache pays off"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries),
+                    "hit_rate": self.hits / lookups if lookups else None}
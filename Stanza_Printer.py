@@ -0,0 +1,144 @@
+# StanzaCam - Thermal printer serial transport
+
+import time
+
+STATUS_REQUEST = b'\x10\x04\x01'  # DLE EOT 1 - Request printer status
+ENABLE_DTR = b'\x1d\x61\x20'      # GS a 32 - Printer drives DTR high while busy (Adafruit/CSN-A2 style printers)
+BAUD_CANDIDATES = (115200, 57600, 38400, 19200, 9600)
+
+
+def is_status_byte(byte):
+    """DLE EOT 1 replies always have bits 1 and 4 set and bits 0 and 7 clear"""
+    return byte & 0x93 == 0x12
+
+
+def detect_baud_rate(port, candidates=BAUD_CANDIDATES):
+    """Find the rate the printer is listening at, fastest first
+
+    The printer's own rate is set in its configuration (DIP switches or vendor
+    utility), this only finds it. Returns the detected rate, or None with the
+    port left at its original rate.
+    """
+    original_rate = port.baudrate
+    original_timeout = port.timeout
+    port.timeout = 0.2
+    try:
+        for rate in candidates:
+            port.baudrate = rate
+            port.reset_input_buffer()
+            port.write(STATUS_REQUEST)
+            port.flush()
+            reply = port.read(1)
+            if reply and is_status_byte(reply[0]):
+                return rate
+        port.baudrate = original_rate
+        return None
+    finally:
+        port.timeout = original_timeout
+
+
+def request_status(port, timeout=0.5, attempts=1):
+    """Ask the printer for its status, returns the reply byte or None if it doesn't answer
+
+    Returns as soon as the reply arrives rather than after a fixed wait. Each attempt
+    waits up to timeout seconds (a request sent while the printer resets can be lost).
+    port must be the pyserial port itself, not a SerialTransport.
+    """
+    original_timeout = port.timeout
+    port.timeout = timeout
+    try:
+        for _ in range(attempts):
+            port.reset_input_buffer()
+            port.write(STATUS_REQUEST)
+            port.flush()
+            reply = port.read(1)
+            if reply:
+                return reply[0]
+        return None
+    finally:
+        port.timeout = original_timeout
+
+
+class SerialTransport:
+    """Printer serial port with chunked writes, DTR busy-line flow control and throughput stats
+
+    Drop-in for escpos' pyserial device (printer.device = SerialTransport(...)),
+    anything it doesn't handle itself is passed through to the real port.
+    """
+
+    def __init__(self, port, gpio=None, busy_pin=None, chunk_size=4096, flow_chunk_size=64, busy_timeout=5.0):
+        self.port = port
+        self.gpio = gpio
+        self.busy_pin = busy_pin
+        self.chunk_size = chunk_size            # Without flow control, hand the kernel big blocks
+        self.flow_chunk_size = flow_chunk_size  # With it, small enough to fit in the printer's headroom after busy
+        self.busy_timeout = busy_timeout
+        self.recording = None  # bytearray while a receipt is being recorded for reprints
+        self.reset_stats()
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+    @property
+    def flow_control(self):
+        return self.gpio is not None and self.busy_pin is not None
+
+    def reset_stats(self):
+        self.bytes_written = 0
+        self.write_time = 0.0   # Time spent blocked sending, the part of a print the serial link costs us
+        self.busy_wait = 0.0
+
+    def start_recording(self):
+        """Keep a copy of everything written from now on (e.g. one whole receipt)"""
+        self.recording = bytearray()
+
+    def stop_recording(self):
+        """Bytes written since start_recording(), or None if it wasn't recording"""
+        data = bytes(self.recording) if self.recording is not None else None
+        self.recording = None
+        return data
+
+    def write(self, data):
+        start = time.time()
+        if self.recording is not None:
+            self.recording += data
+        view = memoryview(data)
+        chunk_size = self.flow_chunk_size if self.flow_control else self.chunk_size
+        for offset in range(0, len(view), chunk_size):
+            if self.flow_control:
+                self._wait_until_ready()
+            self.port.write(view[offset:offset + chunk_size])
+            if self.flow_control:
+                # Wait for the chunk to leave the UART, otherwise the kernel buffer keeps
+                # sending after the printer raises busy
+                self.port.flush()
+        self.bytes_written += len(data)
+        self.write_time += time.time() - start
+        return len(data)
+
+    def _wait_until_ready(self):
+        if self.gpio.input(self.busy_pin) != self.gpio.HIGH:
+            return
+        start = time.time()
+        while self.gpio.input(self.busy_pin) == self.gpio.HIGH:
+            if time.time() - start > self.busy_timeout:
+                print("ERROR: Printer busy line stuck high, disabling flow control")
+                self.busy_pin = None
+                break
+            time.sleep(0.001)
+        self.busy_wait += time.time() - start
+
+    def report(self):
+        """Wait for everything to be sent, then print and return the throughput since the last reset"""
+        if not self.bytes_written:
+            return None
+        start = time.time()
+        self.port.flush()
+        self.write_time += time.time() - start
+        line_time = self.bytes_written * 10 / self.port.baudrate  # 8N1 - 10 bits per byte
+        rate = self.bytes_written / max(self.write_time, 1e-6)
+        print(f"Serial: {self.bytes_written} bytes, {self.write_time:.1f} s sending ({rate:.0f} B/s), "
+              f"line time {line_time:.1f} s at {self.port.baudrate} baud, busy {self.busy_wait:.1f} s")
+        stats = {"bytes": self.bytes_written, "seconds": self.write_time, "busy_seconds": self.busy_wait}
+        self.reset_stats()
+        return stats
@@ -0,0 +1,166 @@
+# StanzaCam - Thermal printer raster engine
+#
+# Turns a photo into ESC/POS "GS v 0" raster bands without going through escpos' image code.
+
+import numpy as np
+from PIL import Image
+
+PRINTER_DOTS = 384  # Print head width in dots
+DITHER_METHODS = ("floyd-steinberg", "atkinson", "bayer", "threshold")
+
+# Luma weights (ITU-R BT.601), same as PIL's convert("L")
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def _bayer_matrix(n):
+    """n x n ordered dither threshold map (n a power of 2), values scaled to 0-255"""
+    m = np.zeros((1, 1), dtype=np.float32)
+    while m.shape[0] < n:
+        m = np.block([[4 * m, 4 * m + 2], [4 * m + 3, 4 * m + 1]])
+    return (m + 0.5) * (256.0 / (n * n))
+
+_BAYER_8 = _bayer_matrix(8)
+
+
+def to_grayscale(img):
+    """Convert a PIL image or RGB/grayscale array to a float32 luminance array (0-255)"""
+    arr = np.asarray(img)
+    if arr.ndim == 2:
+        return arr.astype(np.float32)
+    return arr[..., :3].astype(np.float32) @ _LUMA
+
+
+def dither(gray, method="floyd-steinberg"):
+    """Reduce a grayscale array to dots, returns a bool array where True means black"""
+    if method == "floyd-steinberg":
+        # PIL's error diffusion is implemented in C, far faster than anything row-by-row in Python
+        img = Image.fromarray(np.clip(gray, 0, 255).astype(np.uint8))
+        return ~np.asarray(img.convert("1", dither=Image.Dither.FLOYDSTEINBERG))
+    if method == "atkinson":
+        return _atkinson(gray)
+    if method == "bayer":
+        h, w = gray.shape
+        thresholds = np.tile(_BAYER_8, (h // 8 + 1, w // 8 + 1))[:h, :w]
+        return gray < thresholds
+    if method == "threshold":
+        return gray < 128
+    raise ValueError(f"Unknown dither method: {method}")
+
+
+def _atkinson(gray):
+    # Atkinson spreads 6/8 of the error to neighbours, which keeps highlights clean on thermal paper.
+    # Error diffusion is inherently sequential, so this works on plain lists (much faster than
+    # indexing numpy arrays one pixel at a time). Rows are padded by 2 on each side to skip bounds checks.
+    h, w = gray.shape
+    padded = np.zeros((h + 2, w + 4), dtype=np.float32)
+    padded[:h, 2:w + 2] = gray
+    rows = padded.tolist()
+    out = np.zeros((h, w), dtype=bool)
+    for y in range(h):
+        r0, r1, r2 = rows[y], rows[y + 1], rows[y + 2]
+        black = []
+        for x in range(2, w + 2):
+            old = r0[x]
+            if old < 128:
+                err = old / 8
+                black.append(True)
+            else:
+                err = (old - 255) / 8
+                black.append(False)
+            r0[x + 1] += err
+            r0[x + 2] += err
+            r1[x - 1] += err
+            r1[x] += err
+            r1[x + 1] += err
+            r2[x] += err
+        out[y] = black
+    return out
+
+
+def pack_rows(dots, width=PRINTER_DOTS):
+    """Centre the dots on the print head and pack them 8 to a byte (MSB = leftmost dot)"""
+    h, w = dots.shape
+    if w < width:
+        left = (width - w) // 2
+        canvas = np.zeros((h, width), dtype=bool)
+        canvas[:, left:left + w] = dots
+        dots = canvas
+    elif w % 8:
+        dots = np.pad(dots, ((0, 0), (0, 8 - w % 8)))
+    return np.packbits(dots, axis=1)
+
+
+def _raster_command(block):
+    rows, row_bytes = block.shape
+    header = b'\x1d\x76\x30\x00' + bytes((row_bytes & 0xFF, row_bytes >> 8, rows & 0xFF, rows >> 8))
+    return header + block.tobytes()
+
+
+def raster_bands(packed, band_bytes=2048):
+    """Split packed rows into GS v 0 commands that each fit in the printer's buffer"""
+    h, row_bytes = packed.shape
+    band_rows = max(1, band_bytes // row_bytes)
+    bands = []
+    for top in range(0, h, band_rows):
+        bands.append(_raster_command(packed[top:top + band_rows]))
+    return bands
+
+
+def _feed_commands(dots):
+    # ESC J n - print and feed n dots (n up to 255)
+    commands = []
+    while dots > 0:
+        step = min(dots, 255)
+        commands.append(b'\x1b\x4a' + bytes((step,)))
+        dots -= step
+    return commands
+
+
+def compact_bands(packed, band_bytes=2048, trim_left=False):
+    """Like raster_bands, but skips the blank parts of the image
+
+    Runs of all-white rows become paper feeds and each band is cut down to the
+    columns that actually have dots. The right margin is always trimmed (the band
+    starts at the left edge either way). Trimming the left margin moves the band
+    with GS L, so only use it on printers whose left margin is set in dots.
+    """
+    h, row_bytes = packed.shape
+    band_rows = max(1, band_bytes // row_bytes)
+    inked = packed.any(axis=1)
+
+    commands = [b'\x1b\x61\x00']  # ESC a 0 - left justify so trimmed bands line up
+    top = 0
+    while top < h:
+        # Blank run - feed the paper instead of sending rows of zeros
+        if not inked[top]:
+            end = top
+            while end < h and not inked[end]:
+                end += 1
+            commands.extend(_feed_commands(end - top))
+            top = end
+            continue
+
+        # Inked run - send it in bands, stopping early at the next blank row
+        end = top
+        while end < h and end - top < band_rows and inked[end]:
+            end += 1
+        band = packed[top:end]
+        columns = np.flatnonzero(band.any(axis=0))
+        left = int(columns[0]) if trim_left else 0
+        right = int(columns[-1]) + 1
+        if left:
+            dots = left * 8
+            commands.append(b'\x1d\x4c' + bytes((dots & 0xFF, dots >> 8)))  # GS L - left margin
+        commands.append(_raster_command(band[:, left:right]))
+        if left:
+            commands.append(b'\x1d\x4c\x00\x00')
+        top = end
+    return commands
+
+
+def encode_image(img, method="floyd-steinberg", band_bytes=2048, compact=True, trim_left=False):
+    """Dither a print-sized image and return its list of raster commands"""
+    packed = pack_rows(dither(to_grayscale(img), method))
+    if compact:
+        return compact_bands(packed, band_bytes, trim_left)
+    return raster_bands(packed, band_bytes)
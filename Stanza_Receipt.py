@@ -0,0 +1,180 @@
+# StanzaCam - Receipt layout and composition
+
+import functools
+import unicodedata
+
+PRINTER_COLUMNS = 32  # Characters per line in the default font
+FONT_COLUMNS = {"a": 32, "b": 42}  # 384 dots across - Font A is 12 dots wide, Font B 9
+
+
+def char_width(ch):
+    """Columns a character takes - 0 for combining marks, 2 for wide (CJK) characters"""
+    if unicodedata.combining(ch) or unicodedata.category(ch) in ("Mn", "Me", "Cf"):
+        return 0
+    if unicodedata.east_asian_width(ch) in ("W", "F"):
+        return 2
+    return 1
+
+
+def text_width(text):
+    """Columns a string takes on the printer"""
+    if text.isascii():
+        return len(text)
+    return sum(char_width(ch) for ch in text)
+
+
+def _break_point(line, width):
+    # Index to break an over-long line at - the last space that fits, or mid-word if there isn't one
+    used = 0
+    fit = len(line)
+    for i, ch in enumerate(line):
+        used += char_width(ch)
+        if used > width:
+            fit = i
+            break
+    fit = max(1, fit)
+    wrap_point = line[:fit].rfind(' ')
+    return fit if wrap_point == -1 else wrap_point
+
+
+def wrap_line(line, width=PRINTER_COLUMNS):
+    """Split one line of text into printer-width lines, breaking at the last space if possible"""
+    lines = []
+    line = line.rstrip()  # Trailing spaces don't print, and shouldn't push a line into wrapping
+    while text_width(line) > width:
+        wrap_point = _break_point(line, width)
+        lines.append(line[:wrap_point])
+        line = line[wrap_point:].strip()
+    lines.append(line)
+    return lines
+
+
+@functools.lru_cache(maxsize=64)
+def layout_poem(poem_text, width=PRINTER_COLUMNS):
+    """Printer-width lines of a poem as a tuple, cached so re-laying out the same poem is free"""
+    lines = []
+    for line in unicodedata.normalize("NFC", poem_text).strip().split('\n'):
+        lines.extend(wrap_line(line, width))
+    return tuple(lines)
+
+
+class PoemLineAssembler:
+    """Builds printer-width lines from streamed text chunks
+
+    Uses the same wrapping as layout_poem() on the finished text, but hands each
+    line back as soon as it can no longer change.
+    """
+
+    def __init__(self, width=PRINTER_COLUMNS):
+        self.width = width
+        self.current = ""
+        self.started = False     # Leading blank lines are dropped, like strip()
+        self.pending_blank = 0   # Blank lines are held back until we know they aren't trailing
+        self.wrapped = False     # Current line has already had a piece broken off
+
+    def feed(self, text):
+        """Add a chunk of text, returns the list of lines that are now complete"""
+        ready = []
+        self.current += text
+        while '\n' in self.current:
+            line, self.current = self.current.split('\n', 1)
+            self._finish_line(line, ready)
+        self._emit_long(ready)
+        return ready
+
+    def finish(self):
+        """Flush whatever is left once the stream has ended"""
+        ready = []
+        line = self.current.rstrip()
+        self.current = ""
+        if line.strip():
+            self._finish_line(line, ready)
+        return ready
+
+    def _finish_line(self, line, ready):
+        if self.wrapped:
+            line = line.rstrip()
+            self.wrapped = False
+        if not self.started:
+            line = line.lstrip()
+            if not line:
+                return
+            self.started = True
+        if not line.strip():
+            self.pending_blank += 1
+            return
+        ready.extend([""] * self.pending_blank)
+        self.pending_blank = 0
+        ready.extend(wrap_line(line, self.width))
+
+    def _emit_long(self, ready):
+        # Once the unfinished line is longer than the width its first break point is fixed
+        if not self.started:
+            stripped = self.current.lstrip()
+            if not stripped:
+                return
+            self.current = stripped
+            self.started = True
+        # Trailing spaces might still turn out to be the end of the line, so don't count them
+        while text_width(self.current.rstrip()) > self.width:
+            ready.extend([""] * self.pending_blank)
+            self.pending_blank = 0
+            wrap_point = _break_point(self.current, self.width)
+            ready.append(self.current[:wrap_point])
+            self.current = self.current[wrap_point:].lstrip()
+            self.wrapped = True
+
+
+class Receipt:
+    """A receipt (or part of one) composed in memory and sent to the printer in one write
+
+    Built on an escpos Dummy printer, so text goes through the same code page
+    handling as printing directly.
+    """
+
+    def __init__(self, profile=None):
+        from escpos.printer import Dummy  # escpos is slow to import, so not until the first receipt
+        self.doc = Dummy()
+        if profile is not None:
+            self.doc.profile = profile  # Same paper width settings as the real printer
+
+    def text(self, text):
+        self.doc.text(unicodedata.normalize("NFC", text))
+        return self
+
+    def raw(self, data):
+        self.doc._raw(data)
+        return self
+
+    def set(self, **style):
+        """escpos text style, e.g. align="center", font="b", bold=True"""
+        self.doc.set(**style)
+        return self
+
+    def lines(self, lines, align="center", font="a"):
+        """Pre-wrapped lines in a font, returning to Font A afterwards"""
+        self.set(align=align, font=font)
+        self.text("".join(line + "\n" for line in lines))
+        if font != "a":
+            self.set(font="a")
+        return self
+
+    def poem(self, poem_text, font="a"):
+        return self.lines(layout_poem(poem_text, FONT_COLUMNS[font]), font=font)
+
+    def wrapped(self, text, font="a", align="center"):
+        """Free text (e.g. an error message) wrapped to the font's width"""
+        return self.lines(wrap_line(" ".join(text.split()), FONT_COLUMNS[font]), align=align, font=font)
+
+    def getvalue(self):
+        return self.doc.output
+
+    def __len__(self):
+        return len(self.doc.output)
+
+    def send(self, printer):
+        """Write the whole receipt to an escpos printer at once, returns the byte count"""
+        data = self.getvalue()
+        if data:
+            printer._raw(data)
+        return len(data)
@@ -0,0 +1,147 @@
+# StanzaCam - Reprint cache
+#
+# Every receipt that prints is kept as the exact bytes that went down the serial
+# link (photo raster and laid-out poem), so a second copy only costs the time to
+# send it again - no camera, dithering or API call. Each receipt is one <id>.bin
+# file; once the folder goes over its size cap the least recently printed go first.
+#
+# With StanzaCam stopped, reprint from the command line:
+#   python3 Stanza_Reprint.py list
+#   python3 Stanza_Reprint.py send --last 2
+
+import argparse
+import collections
+import os
+import threading
+import time
+
+
+class ReceiptCache:
+    """Size-capped folder of finished receipts, least recently printed evicted first"""
+
+    def __init__(self, directory, max_bytes=20 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()  # id -> size, least recently printed first
+        os.makedirs(directory, exist_ok=True)
+
+        # File times keep the order across restarts (they're touched on every reprint)
+        files = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith(".tmp"):
+                os.remove(path)  # Left over from a crash part way through a write
+            elif name.endswith(".bin"):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, receipt_id, size in sorted(files):
+            self.entries[receipt_id] = size
+        self._evict()
+
+    def _path(self, receipt_id):
+        return os.path.join(self.directory, receipt_id + ".bin")
+
+    def add(self, receipt_id, data):
+        """Keep a printed receipt's bytes"""
+        tmp_path = self._path(receipt_id) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(receipt_id))
+        with self.lock:
+            self.entries[receipt_id] = len(data)
+            self.entries.move_to_end(receipt_id)
+            self._evict()
+
+    def get(self, receipt_id):
+        """A receipt's bytes (counts as printing it again for the eviction order), None if it's gone"""
+        try:
+            with open(self._path(receipt_id), "rb") as f:
+                data = f.read()
+            os.utime(self._path(receipt_id))
+        except OSError:
+            with self.lock:
+                self.entries.pop(receipt_id, None)
+            return None
+        with self.lock:
+            self.entries[receipt_id] = len(data)
+            self.entries.move_to_end(receipt_id)
+        return data
+
+    def latest(self, count=1):
+        """Ids of the most recently printed receipts, newest first"""
+        with self.lock:
+            return list(reversed(self.entries))[:count]
+
+    def total_bytes(self):
+        with self.lock:
+            return sum(self.entries.values())
+
+    def _evict(self):
+        # Caller holds the lock (or is __init__). Always keep the newest, even if it's over the cap alone
+        total = sum(self.entries.values())
+        while total > self.max_bytes and len(self.entries) > 1:
+            receipt_id, size = self.entries.popitem(last=False)
+            total -= size
+            try:
+                os.remove(self._path(receipt_id))
+            except OSError:
+                pass
+
+
+def receipt_time(receipt_id):
+    """Receipt ids are the capture time (1769170000_123), as a readable local time"""
+    try:
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(float(receipt_id.replace("_", "."))))
+    except ValueError:
+        return receipt_id
+
+
+def list_command(args):
+    cache = ReceiptCache(args.cache, max_bytes=float("inf"))
+    receipts = cache.latest(len(cache.entries))
+    if not receipts:
+        print("No receipts cached")
+        return
+    for number, receipt_id in enumerate(receipts, start=1):
+        print(f"{number:>4}  {receipt_time(receipt_id)}  {cache.entries[receipt_id]:>8} bytes  {receipt_id}")
+    print(f"{len(receipts)} receipts, {cache.total_bytes() / 1024 / 1024:.1f} MB")
+
+
+def send_command(args):
+    import serial
+
+    cache = ReceiptCache(args.cache, max_bytes=float("inf"))
+    receipt_ids = args.ids or list(reversed(cache.latest(args.last)))  # Oldest first, like they were printed
+    if not receipt_ids:
+        print("No receipts cached")
+        return
+    with serial.Serial(args.port, args.baud, timeout=1) as port:
+        for receipt_id in receipt_ids:
+            data = cache.get(receipt_id)
+            if data is None:
+                print(f"ERROR: Receipt {receipt_id} is not in the cache")
+                continue
+            start = time.time()
+            port.write(data)
+            port.flush()
+            print(f"Reprinted {receipt_id} ({len(data)} bytes) in {time.time() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="StanzaCam reprint tools (stop StanzaCam first, it holds the port)")
+    parser.add_argument("--cache", default="reprints", help="Cache folder (REPRINT_CACHE_DIR)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = commands.add_parser("list", help="Cached receipts, most recently printed first")
+    list_parser.set_defaults(func=list_command)
+
+    send_parser = commands.add_parser("send", help="Send cached receipts straight to the printer")
+    send_parser.add_argument("ids", nargs="*", help="Receipt ids (default the most recent)")
+    send_parser.add_argument("--last", type=int, default=1, help="Number of recent receipts to reprint (default 1)")
+    send_parser.add_argument("--port", default="/dev/serial0")
+    send_parser.add_argument("--baud", type=int, default=9600, help="Printer baud rate (default 9600)")
+    send_parser.set_defaults(func=send_command)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,125 @@
+# StanzaCam - Offline spool
+#
+# Shots whose poem couldn't be generated (no internet, rate limited, API down) are kept
+# on disk until the API answers again. Each job is a JPEG plus a JSON file, both written
+# atomically; the JSON is written last so a job only exists once its photo is safe.
+
+import json
+import os
+import random
+import time
+
+
+def _write_atomic(path, data):
+    """Write data to path so that a crash leaves either the old file or the new one"""
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        # Whatever went wrong (including bad data), don't leave half a file behind
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class Spool:
+    """Folder of shots waiting for a poem, safe across crashes and power cuts"""
+
+    def __init__(self, directory, retry_min=15.0, retry_max=600.0):
+        self.directory = directory
+        self.retry_min = retry_min
+        self.retry_max = retry_max
+        os.makedirs(directory, exist_ok=True)
+        self._clean_up()
+
+    def _clean_up(self):
+        # Leftovers from a crash part way through a write - temp files, or a photo with no job file
+        names = set(os.listdir(self.directory))
+        for name in names:
+            stem, ext = os.path.splitext(name)
+            if ext == ".tmp" or (ext == ".jpg" and stem + ".json" not in names):
+                os.remove(os.path.join(self.directory, name))
+
+    def _sync_directory(self):
+        # Make the renames themselves durable
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _path(self, job_id, ext):
+        return os.path.join(self.directory, job_id + ext)
+
+    def add(self, jpeg_bytes, prompt_text, model, error=None, retry_after=None, archive_id=None):
+        """Spool a shot, returns its job dict"""
+        now = time.time()
+        job = {
+            "id": f"{now:.3f}".replace(".", "_"),
+            "created": now,
+            "prompt": prompt_text,
+            "model": model,
+            "attempts": 1,
+            "last_error": error,
+            "next_try": now + self.backoff(1, retry_after),
+            "poem": None,
+            "archive_id": archive_id,  # Catalog row to update once it prints, if the shot was archived
+        }
+        _write_atomic(self._path(job["id"], ".jpg"), jpeg_bytes)
+        try:
+            _write_atomic(self._path(job["id"], ".json"), json.dumps(job).encode("utf-8"))
+        except BaseException:
+            os.remove(self._path(job["id"], ".jpg"))  # A photo without its job would never be retried
+            raise
+        self._sync_directory()
+        return job
+
+    def jobs(self):
+        """All spooled jobs, oldest first"""
+        jobs = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), "rb") as f:
+                    jobs.append(json.loads(f.read()))
+            except (OSError, ValueError) as e:
+                print(f"ERROR: Skipping unreadable spool job {name} - {e}")
+        return jobs
+
+    def load_image(self, job):
+        """JPEG bytes of a job's photo"""
+        with open(self._path(job["id"], ".jpg"), "rb") as f:
+            return f.read()
+
+    def update(self, job):
+        _write_atomic(self._path(job["id"], ".json"), json.dumps(job).encode("utf-8"))
+
+    def retry_later(self, job, error, retry_after=None):
+        """Record a failed attempt and schedule the next one"""
+        job["attempts"] += 1
+        job["last_error"] = error
+        job["next_try"] = time.time() + self.backoff(job["attempts"], retry_after)
+        self.update(job)
+
+    def remove(self, job):
+        # Job file first, so a crash in between leaves an orphan photo (cleaned up) rather than a broken job
+        for ext in (".json", ".jpg"):
+            try:
+                os.remove(self._path(job["id"], ext))
+            except FileNotFoundError:
+                pass
+
+    def backoff(self, attempts, retry_after=None):
+        """Seconds until the next try - exponential with jitter, never sooner than the server asked"""
+        delay = min(self.retry_max, self.retry_min * 2 ** (attempts - 1))
+        delay *= random.uniform(0.8, 1.2)
+        if retry_after:
+            delay = max(delay, retry_after)
+        return delay
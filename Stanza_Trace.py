@@ -0,0 +1,200 @@
+# StanzaCam - Per-shot latency tracing
+#
+# Every shot carries a Trace through the pipeline. Stages add their time to it as
+# spans, and once the shot is finished it is written as one line of JSON:
+#   {"time": 1769170000.0, "source": "camera", "outcome": "printed", "model": "...",
+#    "spans": {"capture": 12.5, "ttft": 950.1, ...}, "total": 8123.4}
+# Span times are in milliseconds. Summarise a session with:
+#   python3 Stanza_Trace.py report traces.jsonl
+
+import argparse
+import contextlib
+import json
+import os
+import threading
+import time
+
+# Report order - the pipeline roughly in the order a shot goes through it
+STAGES = (
+    "focus",          # Waiting for autofocus (on_press) or the time focus took to settle before the press
+    "capture",        # Getting the frame into memory
+    "confirm",        # User deciding whether to print
+    "queue_wait",     # Waiting for the print worker
+    "comms_test",     # Printer status check
+    "poem_cache",     # Hashing the frame and looking for a cached poem
+    "upload_encode",  # Downscale and JPEG encode for upload
+    "hedge_wait",     # Time before the backup request that answered first was sent
+    "upload",         # Request sent until the response started (streaming only)
+    "ttft",           # Request sent until the first poem text
+    "generation",     # Request sent until the whole poem was back
+    "print_resize",   # Downscale to print width
+    "raster_encode",  # Dither and pack for the printer
+    "serial",         # Blocked sending to the printer
+)
+
+
+class Trace:
+    """Timings and details of one shot, safe to add to from several threads"""
+
+    def __init__(self, **fields):
+        self.start = time.time()
+        self.spans = {}
+        self.fields = fields
+        self.open_spans = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds):
+        """Add time to a stage (repeated stages add up)"""
+        with self.lock:
+            self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def begin(self, name):
+        """Start a stage that ends somewhere else (e.g. in another thread)"""
+        with self.lock:
+            self.open_spans[name] = time.perf_counter()
+
+    def end(self, name):
+        with self.lock:
+            start = self.open_spans.pop(name, None)
+        if start is not None:
+            self.add(name, time.perf_counter() - start)
+
+    def set(self, **fields):
+        with self.lock:
+            self.fields.update(fields)
+
+    def record(self):
+        """The JSON-ready record, with the total time from the start of the trace until now"""
+        with self.lock:
+            record = {"time": round(self.start, 3)}
+            record.update(self.fields)
+            record["spans"] = {name: round(seconds * 1000, 1) for name, seconds in self.spans.items()}
+            record["total"] = round((time.time() - self.start) * 1000, 1)
+        return record
+
+
+class TraceLog:
+    """Append-only JSONL file of trace records"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, trace):
+        line = json.dumps(trace.record()) + "\n"
+        try:
+            with self.lock, open(self.path, "a") as f:
+                f.write(line)
+        except OSError as e:
+            print(f"ERROR: Failed to write trace - {e}")
+
+
+def load_records(paths):
+    """All records from one or more trace files, skipping any broken lines"""
+    records = []
+    for path in paths:
+        with open(path) as f:
+            for line_number, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    print(f"ERROR: Skipping broken trace line {path}:{line_number}")
+    return records
+
+
+def percentile(values, p):
+    """p-th percentile (0-100) with linear interpolation, values must be sorted"""
+    if not values:
+        return None
+    position = (len(values) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(records):
+    """{stage: {"count", "p50", "p95", "p99", "max"}} in milliseconds, stages in pipeline order"""
+    values = {}
+    for record in records:
+        for name, ms in record.get("spans", {}).items():
+            values.setdefault(name, []).append(ms)
+        if "total" in record:
+            values.setdefault("total", []).append(record["total"])
+
+    order = [name for name in STAGES if name in values]
+    order += sorted(name for name in values if name not in STAGES and name != "total")
+    if "total" in values:
+        order.append("total")
+
+    summary = {}
+    for name in order:
+        stage_values = sorted(values[name])
+        summary[name] = {
+            "count": len(stage_values),
+            "p50": percentile(stage_values, 50),
+            "p95": percentile(stage_values, 95),
+            "p99": percentile(stage_values, 99),
+            "max": stage_values[-1],
+        }
+    return summary
+
+
+def report(args):
+    records = load_records(args.files)
+    if args.hours:
+        cutoff = time.time() - args.hours * 3600
+        records = [record for record in records if record.get("time", 0) >= cutoff]
+    if args.last:
+        records = records[-args.last:]
+    if not records:
+        print("No shots to report")
+        return
+
+    first = time.strftime("%Y-%m-%d %H:%M", time.localtime(records[0].get("time", 0)))
+    last = time.strftime("%Y-%m-%d %H:%M", time.localtime(records[-1].get("time", 0)))
+    print(f"{len(records)} shots, {first} to {last}")
+
+    outcomes = {}
+    for record in records:
+        outcome = record.get("outcome", "unknown")
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    print(", ".join(f"{count} {outcome}" for outcome, count in sorted(outcomes.items(), key=lambda item: -item[1])))
+
+    cache_hits = sum(1 for record in records if record.get("poem_cache") == "hit")
+    cache_misses = sum(1 for record in records if record.get("poem_cache") == "miss")
+    if cache_hits or cache_misses:
+        print(f"Poem cache: {cache_hits} hits, {cache_misses} misses "
+              f"({cache_hits / (cache_hits + cache_misses):.0%} of poems without an API call)")
+
+    print(f"\n{'stage (ms)':<16}{'count':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for name, stats in summarize(records).items():
+        print(f"{name:<16}{stats['count']:>7}{stats['p50']:>10.0f}{stats['p95']:>10.0f}"
+              f"{stats['p99']:>10.0f}{stats['max']:>10.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="StanzaCam trace tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    report_parser = commands.add_parser("report", help="Per-stage p50/p95/p99 across a session")
+    report_parser.add_argument("files", nargs="*", default=["traces.jsonl"], help="Trace files (default traces.jsonl)")
+    report_parser.add_argument("--hours", type=float, help="Only shots from the last HOURS hours")
+    report_parser.add_argument("--last", type=int, help="Only the last N shots")
+    report_parser.set_defaults(func=report)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -24,4 +24,115 @@ CLAUDE_MODELS = {
     2: "claude-haiku-4-5-20251001",  # Fast & cheap
     3: "claude-sonnet-4-5-20250929", # Balanced (saving to file)
     4: "claude-haiku-4-5-20251001",  # Fast & cheap (saving to file)
-}
\ No newline at end of file
+}
+# ----- Optional settings (defaults are used if these are missing) -----
+
+# Image upload - the photo is downscaled and re-encoded before it is sent to Claude
+UPLOAD_MAX_EDGE = 1568      # Long edge in pixels (~1.4 MP for a 16:9 photo)
+UPLOAD_MAX_BYTES = 500000   # Byte budget, quality then size is reduced until it fits
+UPLOAD_JPEG_QUALITY = 85    # Starting JPEG quality
+
+# Archiving - shots on the "saving to file" model positions are saved to ARCHIVE_DIR
+# (photos plus a catalog.db of prompts, poems and print status) by a background thread.
+# Browse and export with: python3 Stanza_Archive.py stats captures
+ARCHIVE_MODEL_POSITIONS = (3, 4)    # Rotary 2 positions that save to file, () for none
+ARCHIVE_CAPTURES = False            # Archive every shot, whatever the model position
+ARCHIVE_DIR = "captures"
+
+# Speculative mode - send the poem request as soon as the photo is taken, while the
+# LED blinks white waiting for print confirmation. Hides up to 3 s of network time,
+# but shots that are never printed may still cost an API call.
+SPECULATIVE_POEM = False
+
+# Streaming - print the poem line by line as Claude writes it instead of waiting for the end
+STREAM_POEM = True
+
+# Hedging - if the selected model hasn't sent any of the poem within HEDGE_DELAY seconds,
+# the same request also goes to a faster model and whichever answers first is printed
+# (the other is cancelled). Can cost a second API call on slow shots.
+HEDGE_DELAY = None                  # e.g. 3.0, None to turn off
+HEDGE_MODEL = None                  # Backup model, None for the Haiku model in CLAUDE_MODELS
+POEM_DEADLINE = None                # Longest wait for the poem in seconds, None for no limit. If none of it has
+                                    # arrived the shot is spooled for a retry, if it's part way the lines so far
+                                    # print followed by "..."
+
+# Poem cache - for setup and rehearsals: a frame that looks nearly the same as a recent one
+# (perceptual hash), with the same prompt and model, reuses its poem instead of calling the API.
+# Hits and misses are logged and counted in: python3 Stanza_Trace.py report
+POEM_CACHE = False
+POEM_CACHE_FILE = "poem_cache.json"
+POEM_CACHE_DISTANCE = 6             # Bits (of 64) the frames can differ by, 0 for only identical frames
+POEM_CACHE_TTL = 3600               # Seconds a poem can be reused for, None for no limit
+POEM_CACHE_SIZE = 200               # Poems kept, least recently used go first
+
+# Seconds between keep-alives on the Claude API connection, so it's already open when the button is pressed
+CLAUDE_KEEPALIVE_INTERVAL = 20
+
+# Receipt layout - each part of the receipt is composed in memory and sent in one write
+RECEIPT_FONT = "a"                  # Poem font: "a" (32 columns) or "b" (smaller, 42 columns)
+RECEIPT_HEADER = None               # Line printed above the photo, e.g. "Summer Fete 2026"
+
+# Image printing
+IMAGE_PRINT_MODE = "raster"         # "raster" = StanzaCam raster engine, "escpos" = old bitImageColumn method
+PRINT_RESIZE = "balanced"           # Downscale to print width: "fast", "balanced" or "best" (old full resolution Lanczos)
+RASTER_DITHER = "floyd-steinberg"   # floyd-steinberg, atkinson, bayer or threshold
+RASTER_BAND_BYTES = 2048            # Largest raster block sent at once, keep below the printer's buffer size
+RASTER_SKIP_BLANK = True            # Feed paper over blank rows and trim the right margin instead of sending white dots
+RASTER_TRIM_LEFT = False            # Also trim the left margin - only for printers that set GS L margins in dots
+
+# Printer serial link
+PRINTER_BAUD_RATE = 9600            # Or "auto" to use the fastest rate the printer answers at (set the printer's rate first)
+PRINTER_FLOW_CONTROL = True         # Pause while the printer holds DTR (GPIO 18) high, needed for rates above 9600
+
+# Print queue - receipts print in the background so the next photo can be taken straight away
+PRINT_QUEUE_SIZE = 3                # Receipts waiting to print (each keeps its photo in memory), spooled shots leave one free
+PRINT_QUEUE_FULL = "reject"         # When full: "reject" new shots (LED flashes red) or "wait" for a free slot
+
+# Offline spool - shots whose poem fails because the network or API is down are kept on disk
+# and the full receipt prints once a poem comes back (also survives a restart)
+SPOOL_ENABLED = True
+SPOOL_DIR = "spool"
+SPOOL_RETRY_MIN = 15                # Seconds before the first retry, doubling up to SPOOL_RETRY_MAX
+SPOOL_RETRY_MAX = 600
+
+# Startup - the camera, printer and Claude API connection start at the same time, and each is
+# ready as soon as it answers (focused frames, a printer status reply, an open connection).
+# The time each took is logged on the "Startup" line
+STARTUP_TIMEOUT = 10                # Seconds to wait for them before carrying on anyway
+
+# Autofocus
+FOCUS_MODE = "continuous"           # "continuous" keeps focusing, "on_press" runs one AF cycle when the button is pressed
+FOCUS_STABLE_FRAMES = 3             # Frames the lens must hold still before the camera counts as focused
+FOCUS_TIMEOUT = 2.0                 # Seconds to wait for focus in on_press mode before taking the photo anyway
+
+# Camera streams - by default the camera runs a main stream sized for the printer and upload
+# plus a small lores stream for focus, instead of producing full sensor frames all the time
+CAMERA_PROFILE = "preview"          # "preview" (sized streams) or "full" (old full-sensor still configuration)
+CAMERA_MAIN_SIZE = (2304, 1296)     # Main stream size, the photo you get
+CAMERA_LORES_SIZE = (640, 360)      # Low resolution stream for focus and metering
+CAMERA_FULL_RES_CAPTURE = False     # Switch to the full 4608x2592 sensor just for the shot (slower, more memory)
+
+# Zero shutter lag - the camera keeps its last few frames and a press uses the sharpest of them
+# (judged on the lores stream), so there's no wait for a new frame and less hand-shake blur.
+# Each frame holds a main stream buffer (about 9 MB at the default size), so the default 2 uses
+# 4 buffers in all, no more than one old full sensor still. Not used with FOCUS_MODE = "on_press"
+# or CAMERA_FULL_RES_CAPTURE, which don't take frames from before the press
+ZSL_FRAMES = 2                      # 0 to take the next frame instead
+
+# Crop and orientation done by the camera (ScalerCrop and a flip transform), so frames come out
+# already cropped instead of being cut from a full resolution frame. The ISP can't turn by 90
+# degrees, so 90/270 is done on the small cropped frame
+CAMERA_ROTATION = 0                 # Degrees counter-clockwise, e.g. 270 for a camera mounted sideways
+CAMERA_CROP = None                  # Centred (width, height) after rotation in sensor pixels, e.g. (1920, 1080)
+
+# Tracing - each shot's stage timings (capture, upload, time to first token, printing, ...)
+# are appended as one JSON line. Summarise with: python3 Stanza_Trace.py report
+TRACE_FILE = "traces.jsonl"         # None to turn off
+
+# Reprints - every printed receipt is kept as the bytes sent to the printer. Keep the button
+# held after a shot to reprint instead (the shot is thrown away), which only costs the serial
+# transfer. With StanzaCam stopped: python3 Stanza_Reprint.py send --last 2
+REPRINT_CACHE_DIR = "reprints"      # None to turn off
+REPRINT_CACHE_MB = 20               # Size cap, least recently printed receipts are dropped first
+REPRINT_HOLD = 2.0                  # Seconds to hold the button, None to turn off the gesture
+REPRINT_COUNT = 1                   # Receipts reprinted by the gesture